@@ -0,0 +1,386 @@
+import asyncio
+import itertools
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from collections.abc import Awaitable, Callable
+
+import click
+import discord
+from sqlalchemy import delete, or_, select
+from tabulate import tabulate
+
+from talesbot import actors, finances, handles, players, server, shops
+from talesbot.common import emoji_accept
+from talesbot.config import config_dir
+from talesbot.custom_types import ActionResult, Actor
+from talesbot.database import SessionM, create_tables, engine
+from talesbot.database import order as order_db
+from talesbot.database.models import Handle, Transaction
+
+# Drives the shop pipeline (storefront reaction -> payment -> order flow post ->
+# lock -> delivery) with synthetic customers against fake Discord objects,
+# and reports the latency and throughput of every stage.
+# All config files live in a throwaway directory; the ledger accounts and orders
+# are written to the configured database and removed again afterwards.
+
+bench_prefix = "bench_"
+bench_shop_id = f"{bench_prefix}shop"
+
+ids = itertools.count(10**15)
+
+# In the order an order passes through them
+order_stages = ["storefront reaction", "payment", "order flow post"]
+delivery_stages = ["lock", "delivery"]
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeTextChannel", content: str):
+        self.id = next(ids)
+        self.channel = channel
+        self.content = content
+        self.reactions: list[str] = []
+
+    async def add_reaction(self, emoji):
+        await self.channel.guild.api_call()
+        if str(emoji) not in self.reactions:
+            self.reactions.append(str(emoji))
+
+    async def clear_reactions(self):
+        await self.channel.guild.api_call()
+        self.reactions = []
+
+    async def edit(self, content: str | None = None, **kwargs):
+        await self.channel.guild.api_call()
+        if content is not None:
+            self.content = content
+
+    async def delete(self):
+        await self.channel.guild.api_call()
+        self.channel.messages.pop(self.id, None)
+
+
+class FakeTextChannel:
+    def __init__(self, guild: "FakeGuild", name: str):
+        self.id = next(ids)
+        self.guild = guild
+        self.name = name
+        self.messages: dict[int, FakeMessage] = {}
+
+    async def send(self, content: str | None = None, **kwargs):
+        await self.guild.api_call()
+        message = FakeMessage(self, content or "")
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, msg_id: int):
+        await self.guild.api_call()
+        message = self.messages.get(int(msg_id))
+        if message is None:
+            raise discord.errors.NotFound(FakeResponse(), "Unknown Message")
+        return message
+
+
+class FakeResponse:
+    status = 404
+    reason = "Not Found"
+
+
+class FakeGuild:
+    # Every call to the Discord API waits for the simulated round trip
+    def __init__(self, latency: float):
+        self.id = next(ids)
+        self.name = "bench"
+        self.latency = latency
+        self.channels: list[FakeTextChannel] = []
+        self.roles = []
+        self.api_calls = 0
+
+    async def api_call(self):
+        self.api_calls += 1
+        await asyncio.sleep(self.latency)
+
+    def create_channel(self, name: str):
+        channel = FakeTextChannel(self, name)
+        self.channels.append(channel)
+        return channel
+
+    def get_channel(self, channel_id: int):
+        return next((ch for ch in self.channels if ch.id == channel_id), None)
+
+
+class StageTimes:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self.failures: dict[str, int] = defaultdict(int)
+        self.errors: Counter[str] = Counter()
+        # The wall clock time of the phase every stage ran in
+        self.elapsed: dict[str, float] = {}
+
+    async def measure(self, stage: str, coro: Awaitable):
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.samples[stage].append(time.perf_counter() - start)
+
+    async def react(self, stage: str, coro: Awaitable[ActionResult]):
+        # A reaction that raises only fails that reaction, just like in the bot
+        try:
+            result = await self.measure(stage, coro)
+        except Exception as e:
+            self.errors[f"{stage}: {type(e).__name__}"] += 1
+            result = ActionResult()
+        if not result.success:
+            self.failures[stage] += 1
+
+    def wrap(self, stage: str, func: Callable):
+        async def timed(*args, **kwargs):
+            return await self.measure(stage, func(*args, **kwargs))
+
+        return timed
+
+
+def percentile(values: list[float], q: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def setup_actor(guild: FakeGuild, actor_id: str):
+    finance_channel = guild.create_channel(f"{actor_id}-finances")
+    chat_channel = guild.create_channel(f"{actor_id}-chats")
+    await handles.init_handles_for_actor(actor_id)
+    actors.store_actor(
+        Actor(
+            role_name=actor_id,
+            actor_id=actor_id,
+            guild_id=guild.id,
+            finance_channel_id=finance_channel.id,
+            finance_stmt_msg_id=0,
+            chat_channel_id=chat_channel.id,
+        )
+    )
+
+
+async def setup_shop(guild: FakeGuild, products: int, price: int):
+    await setup_actor(guild, bench_shop_id)
+    storefront = guild.create_channel(f"{bench_shop_id}-storefront")
+    order_flow = guild.create_channel(f"{bench_shop_id}-orders")
+    shop = shops.Shop(
+        bench_shop_id,
+        bench_shop_id,
+        {str(guild.id): str(storefront.id)},
+        str(order_flow.id),
+    )
+    shops.store_shop(shop)
+    await shops.clear_shop_contents(shop.shop_id)
+    shops.store_storefront_channel_mapping(str(storefront.id), shop.shop_id)
+    shops.store_order_flow_channel_mapping(str(order_flow.id), shop.shop_id)
+
+    product_messages = []
+    with shops.shop_data_batch():
+        for i in range(products):
+            product = shops.Product(f"item{i}", f"Benchmark item {i}", price)
+            message = await storefront.send(
+                shops.generate_catalogue_item_message(product)
+            )
+            product.set_storefront_message_id(guild.id, str(message.id))
+            shops.store_product(shop.shop_id, product)
+            shops.store_storefront_msg_mapping(
+                shop.shop_id,
+                str(message.id),
+                shops.StorefrontAction(
+                    shops.StorefrontActionTypes.Order, product.product_id
+                ),
+            )
+            product_messages.append(message)
+    return (shop, order_flow, product_messages)
+
+
+async def setup_customers(guild: FakeGuild, customers: int, balance: int):
+    user_ids = {}
+    for i in range(customers):
+        actor_id = f"{bench_prefix}c{i}"
+        await setup_actor(guild, actor_id)
+        await finances.set_current_balance_handle_id(actor_id, balance)
+        user_ids[str(next(ids))] = actor_id
+    players_conf = players.get_players_confobj()
+    players_conf[players.user_id_mappings_index].update(user_ids)
+    players_conf.write()
+    return list(user_ids)
+
+
+async def run_orders(
+    times: StageTimes,
+    semaphore: asyncio.Semaphore,
+    user_ids: list[str],
+    product_messages: list,
+    orders: int,
+    rng: random.Random,
+):
+    async def order(user_id: str, message):
+        async with semaphore:
+            await times.react(
+                "storefront reaction",
+                shops.process_reaction_in_storefront(
+                    message, user_id, shops.emoji_shopping
+                ),
+            )
+
+    jobs = [
+        order(rng.choice(user_ids), rng.choice(product_messages)) for _ in range(orders)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(*jobs)
+    return time.perf_counter() - start
+
+
+async def run_deliveries(times: StageTimes, semaphore: asyncio.Semaphore, order_flow):
+    async def handle(stage: str, msg_id: str, emoji: str):
+        async with semaphore:
+            await times.react(
+                stage,
+                shops.process_reaction_in_order_flow(str(order_flow.id), msg_id, emoji),
+            )
+
+    def order_messages(orders: dict):
+        return [
+            str(order.order_flow_msg_id)
+            for (shop_id, _), order in orders.items()
+            if shop_id == bench_shop_id
+        ]
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            handle("lock", msg_id, shops.emoji_locked)
+            for msg_id in order_messages(shops.active_orders)
+        )
+    )
+    times.elapsed["lock"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            handle("delivery", msg_id, emoji_accept)
+            for msg_id in order_messages(shops.locked_orders)
+        )
+    )
+    times.elapsed["delivery"] = time.perf_counter() - start
+
+
+async def cleanup():
+    async with SessionM() as session:
+        await order_db.clear(session, bench_shop_id)
+        names = select(Handle.name).where(Handle.name.startswith(bench_prefix))
+        ids = select(Handle.id).where(Handle.name.in_(names))
+        await session.execute(
+            delete(Transaction).where(
+                or_(Transaction.sender_id.in_(ids), Transaction.receiver_id.in_(ids))
+            )
+        )
+        await session.execute(
+            delete(Handle).where(Handle.name.startswith(bench_prefix))
+        )
+        await session.commit()
+
+
+async def run(
+    customers: int,
+    products: int,
+    orders: int,
+    concurrency: int,
+    latency: float,
+    seed: int | None,
+):
+    await create_tables()
+    await cleanup()
+    guild = FakeGuild(latency)
+    server.guilds[:] = [guild]
+
+    (shop, order_flow, product_messages) = await setup_shop(guild, products, 10)
+    user_ids = await setup_customers(guild, customers, 10 * orders)
+    setup_calls = guild.api_calls
+
+    times = StageTimes()
+    # Time the inner stages of an order as well, without changing what they do
+    original_try_to_pay = finances.try_to_pay
+    original_place_order = shops.place_order_in_flow
+    finances.try_to_pay = times.wrap("payment", original_try_to_pay)
+    shops.place_order_in_flow = times.wrap("order flow post", original_place_order)
+    semaphore = asyncio.Semaphore(concurrency)
+    try:
+        elapsed = await run_orders(
+            times, semaphore, user_ids, product_messages, orders, random.Random(seed)
+        )
+        for stage in order_stages:
+            times.elapsed[stage] = elapsed
+        await run_deliveries(times, semaphore, order_flow)
+    finally:
+        finances.try_to_pay = original_try_to_pay
+        shops.place_order_in_flow = original_place_order
+
+    await cleanup()
+    await engine.dispose()
+
+    rows = []
+    for stage in order_stages + delivery_stages:
+        samples = times.samples[stage]
+        if not samples:
+            continue
+        rows.append(
+            [
+                stage,
+                len(samples),
+                times.failures[stage],
+                f"{1000 * percentile(samples, 0.5):.1f}",
+                f"{1000 * percentile(samples, 0.99):.1f}",
+                f"{1000 * max(samples):.1f}",
+                f"{len(samples) / times.elapsed[stage]:.0f}",
+            ]
+        )
+    click.echo(
+        tabulate(
+            rows,
+            headers=["Stage", "Count", "Failed", "p50 ms", "p99 ms", "Max ms", "Per s"],
+        )
+    )
+    click.echo(
+        f"\n{orders} orders from {customers} customers, "
+        f"{guild.api_calls - setup_calls} Discord calls at {1000 * latency:.0f} ms"
+    )
+    for error, count in sorted(times.errors.items()):
+        click.echo(click.style(f"{count} x {error}", fg="red"))
+    return 1 if any(times.failures.values()) else 0
+
+
+@click.command()
+@click.option("-u", "--customers", default=50, help="Number of synthetic customers")
+@click.option("-p", "--products", default=10, help="Number of products in the shop")
+@click.option("-n", "--orders", default=500, help="Number of orders")
+@click.option("-c", "--concurrency", default=10, help="Reactions in flight")
+@click.option(
+    "-l", "--latency", default=0.0, help="Simulated Discord round trip in seconds"
+)
+@click.option("-s", "--seed", type=int, default=None, help="Random seed")
+def main(
+    customers: int,
+    products: int,
+    orders: int,
+    concurrency: int,
+    latency: float,
+    seed: int | None,
+):
+    """Benchmark the shop order pipeline against fake Discord channels."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        for conf_dir in ["actors", "finances", "handles", "players", "shops"]:
+            os.makedirs(config_dir / conf_dir)
+        code = asyncio.run(run(customers, products, orders, concurrency, latency, seed))
+    raise SystemExit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import asyncio
+import random
+import time
+from collections import Counter
+
+import click
+from sqlalchemy import delete, func, or_, select
+from tabulate import tabulate
+
+from talesbot.database import SessionM, create_tables, engine
+from talesbot.database import transaction as ledger
+from talesbot.database.models import Handle, Transaction
+from talesbot.errors import InsufficientBalanceError
+
+# Fires a lot of concurrent transfers between a set of throwaway accounts
+# and checks that no money was created or destroyed on the way.
+
+account_prefix = "__stress_"
+
+
+async def run_transfer(
+    semaphore: asyncio.Semaphore,
+    results: Counter,
+    sender: str,
+    receiver: str,
+    amount: int,
+    allow_partial: bool,
+):
+    async with semaphore, SessionM() as session:
+        try:
+            transferred = await ledger.transfer(
+                session, sender, receiver, amount, allow_partial=allow_partial
+            )
+            results["ok" if transferred > 0 else "empty"] += 1
+        except InsufficientBalanceError:
+            results["rejected"] += 1
+        except Exception as e:
+            results[f"failed ({type(e).__name__})"] += 1
+
+
+async def check_ledger(names: list[str], opening_balance: int):
+    async with SessionM() as session:
+        accounts = {
+            id: (name, balance)
+            for (id, name, balance) in (
+                await session.execute(
+                    select(Handle.id, Handle.name, Handle.balance).where(
+                        Handle.name.in_(names)
+                    )
+                )
+            ).all()
+        }
+        ids = list(accounts)
+        moved = {id: 0 for id in ids}
+        res = await session.execute(
+            select(Transaction.sender_id, Transaction.receiver_id, Transaction.amount)
+            .where(Transaction.sender_id.in_(ids))
+            .where(Transaction.receiver_id.in_(ids))
+        )
+        for sender_id, receiver_id, amount in res.all():
+            moved[sender_id] -= amount
+            moved[receiver_id] += amount
+
+    total = sum(balance for (_, balance) in accounts.values())
+    negative = [name for (name, balance) in accounts.values() if balance < 0]
+    mismatched = [
+        name
+        for id, (name, balance) in accounts.items()
+        if opening_balance + moved[id] != balance
+    ]
+    return total, negative, mismatched
+
+
+async def cleanup(names: list[str]):
+    async with SessionM() as session:
+        ids = select(Handle.id).where(Handle.name.in_(names))
+        await session.execute(
+            delete(Transaction).where(
+                or_(Transaction.sender_id.in_(ids), Transaction.receiver_id.in_(ids))
+            )
+        )
+        await session.execute(delete(Handle).where(Handle.name.in_(names)))
+        await session.commit()
+
+
+async def run(
+    accounts: int,
+    transfers: int,
+    balance: int,
+    max_amount: int,
+    concurrency: int,
+    partial: float,
+    seed: int | None,
+    keep: bool,
+):
+    await create_tables()
+    names = [f"{account_prefix}{i}" for i in range(accounts)]
+    await cleanup(names)
+    async with SessionM() as session:
+        await ledger.open_accounts(session, {name: balance for name in names})
+
+    rng = random.Random(seed)
+    semaphore = asyncio.Semaphore(concurrency)
+    results = Counter()
+    jobs = []
+    for _ in range(transfers):
+        (sender, receiver) = rng.sample(names, 2)
+        jobs.append(
+            run_transfer(
+                semaphore,
+                results,
+                sender,
+                receiver,
+                rng.randint(1, max_amount),
+                rng.random() < partial,
+            )
+        )
+
+    start = time.perf_counter()
+    await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - start
+
+    total, negative, mismatched = await check_ledger(names, balance)
+    async with SessionM() as session:
+        recorded = await session.scalar(
+            select(func.count())
+            .select_from(Transaction)
+            .join(Handle, Transaction.sender_id == Handle.id)
+            .where(Handle.name.in_(names))
+        )
+    if not keep:
+        await cleanup(names)
+    await engine.dispose()
+
+    rows = [[outcome, count] for (outcome, count) in sorted(results.items())]
+    rows += [
+        ["elapsed", f"{elapsed:.2f} s"],
+        ["throughput", f"{transfers / elapsed:.0f} transfers/s"],
+        ["recorded transactions", recorded],
+        ["money supply", f"{total} (expected {accounts * balance})"],
+    ]
+    click.echo(tabulate(rows, headers=["", "Result"]))
+
+    conserved = total == accounts * balance and recorded == results["ok"]
+    if negative:
+        click.echo(click.style(f"Overdrawn accounts: {negative}", fg="red"))
+    if mismatched:
+        click.echo(
+            click.style(f"Balance does not match history: {mismatched}", fg="red")
+        )
+    if conserved and not negative and not mismatched:
+        click.echo(click.style("✓ Money supply conserved", fg="green"))
+        return 0
+    click.echo(click.style("x Ledger is inconsistent", fg="red"))
+    return 1
+
+
+@click.command()
+@click.option("-a", "--accounts", default=20, help="Number of accounts")
+@click.option("-n", "--transfers", default=5000, help="Number of transfers")
+@click.option("-b", "--balance", default=100, help="Opening balance per account")
+@click.option("-m", "--max-amount", default=60, help="Largest single transfer")
+@click.option("-c", "--concurrency", default=200, help="Transfers in flight")
+@click.option(
+    "-p", "--partial", default=0.2, help="Share of transfers with allow_partial"
+)
+@click.option("-s", "--seed", type=int, default=None, help="Random seed")
+@click.option("-k", "--keep", is_flag=True, help="Keep the accounts afterwards")
+def main(
+    accounts: int,
+    transfers: int,
+    balance: int,
+    max_amount: int,
+    concurrency: int,
+    partial: float,
+    seed: int | None,
+    keep: bool,
+):
+    """Stress test the ledger in the configured database with concurrent transfers."""
+    code = asyncio.run(
+        run(
+            accounts,
+            transfers,
+            balance,
+            max_amount,
+            concurrency,
+            partial,
+            seed,
+            keep,
+        )
+    )
+    raise SystemExit(code)
+
+
+if __name__ == "__main__":
+    main()
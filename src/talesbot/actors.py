@@ -2,12 +2,23 @@
 
 import asyncio
 import logging
+from copy import copy
 from typing import cast
 
 import discord
 from configobj import ConfigObj
 
-from . import channels, common, finances, handles, players, server, shops
+from . import (
+    channels,
+    common,
+    finances,
+    handles,
+    players,
+    role_cleanup,
+    server,
+    shops,
+    snapshot,
+)
 from .common import emoji_cancel, emoji_open
 from .config import config_dir
 from .custom_types import Actor, Transaction, TransTypes
@@ -17,18 +28,55 @@ finance_channel_mapping_index = "___finance_channels"
 logger = logging.getLogger(__name__)
 
 
+# The actors file is parsed once and then kept in memory, along with the actors
+# decoded from it. All changes are written straight through to the file.
+actors_confobj: ConfigObj | None = None
+# actor_id -> Actor, finance channel ID -> actor_id, role name -> actor_id
+actors_by_id: dict[str, Actor] = {}
+actor_ids_by_finance_channel: dict[str, str] = {}
+actor_ids_by_role_name: dict[str, str] = {}
+
+
 def get_actors_confobj():
-    actors = ConfigObj(str(config_dir / actors_conf_dir / "__actors.conf"))
+    global actors_confobj
+    if actors_confobj is None:
+        load_actors_store()
+    return cast(ConfigObj, actors_confobj)
+
+
+def load_actors_store():
+    global actors_confobj
+    actors = snapshot.load_conf(str(config_dir / actors_conf_dir / "__actors.conf"))
     if finance_channel_mapping_index not in actors:
         actors[finance_channel_mapping_index] = {}
         actors.write()
-    return actors
+    actors_confobj = actors
+    actors_by_id.clear()
+    actor_ids_by_role_name.clear()
+    for actor_id in actors:
+        if actor_id != finance_channel_mapping_index:
+            _index_actor(Actor.from_string(actors[actor_id]))
+    actor_ids_by_finance_channel.clear()
+    actor_ids_by_finance_channel.update(actors[finance_channel_mapping_index])
+
 
+def _index_actor(actor: Actor):
+    actors_by_id[actor.actor_id] = actor
+    actor_ids_by_role_name[actor.role_name] = actor.actor_id
 
-async def init(clear_all=False):
-    await shops.init(clear_all=clear_all)
-    await players.init(clear_all=clear_all)
-    get_actors_confobj()  # ensures it's properly initialised
+
+def _unindex_actor(actor_id: str):
+    actor = actors_by_id.pop(actor_id, None)
+    if actor is not None and actor_ids_by_role_name.get(actor.role_name) == actor_id:
+        del actor_ids_by_role_name[actor.role_name]
+
+
+async def init(clear_all=False, with_shops_and_players=True):
+    # At startup, shops and players are initialised as phases of their own
+    if with_shops_and_players:
+        await shops.init(clear_all=clear_all)
+        await players.init(clear_all=clear_all)
+    load_actors_store()
     if clear_all:
         for actor_id in get_all_actor_ids():
             await clear_actor(actor_id)
@@ -49,8 +97,10 @@ async def clear_actor(actor_id: str):
         actors = get_actors_confobj()
         if finance_channel_id in actors[finance_channel_mapping_index]:
             del actors[finance_channel_mapping_index][finance_channel_id]
+            del actor_ids_by_finance_channel[finance_channel_id]
         del actors[actor_id]
         actors.write()
+        _unindex_actor(actor_id)
         clear_trans_memory(actor_id)
         await channels.delete_all_personal_channels(channel_suffix=actor.actor_id)
         await handles.clear_all_handles_for_actor(actor_id)
@@ -62,24 +112,16 @@ async def clear_actor(actor_id: str):
 
 
 async def delete_all_actor_roles(spare_used: bool):
-    task_list = (
-        asyncio.create_task(delete_if_actor_role(r, spare_used))
-        for guild in server.get_guilds()
-        for r in guild.roles
-    )
-    await asyncio.gather(*task_list)
-
-
-async def delete_if_actor_role(role, spare_used: bool):
-    if await is_actor_role(role.name):
-        in_use = (
-            actor_index_in_use(role.name) or len(role.members) > 0 or True
-        )  # TODO: Temporary fix
-        if not in_use or not spare_used:
-            await role.delete()
+    if spare_used:
+        # Actor roles are never deleted while used roles are to be spared:
+        # role.members depends on the member cache, so a role that looks empty
+        # may still belong to a live player. This also keeps clear_actor from
+        # scanning every guild's roles once per actor.
+        return
+    await role_cleanup.delete_roles(is_actor_role, [], spare_used)
 
 
-async def is_actor_role(name: str):
+def is_actor_role(name: str):
     return common.is_player_role(name) or common.is_shop_role(name)
 
 
@@ -98,40 +140,48 @@ def get_all_actors():
 
 
 def get_all_actor_ids():
-    actors = get_actors_confobj()
-    for actor_id in actors:
-        if actor_id != finance_channel_mapping_index:
-            yield cast(str, actor_id)
+    get_actors_confobj()
+    # A copy, so that actors can be cleared while looping
+    yield from list(actors_by_id)
 
 
 def actor_exists(actor_id: str):
-    actors = get_actors_confobj()
-    return actor_id in actors
+    get_actors_confobj()
+    return actor_id in actors_by_id
+
+
+def get_all_actor_role_names():
+    get_actors_confobj()
+    return list(actor_ids_by_role_name)
 
 
 def actor_index_in_use(actor_index: str):
-    return any(actor.role_name == actor_index for actor in get_all_actors())
+    get_actors_confobj()
+    return actor_index in actor_ids_by_role_name
 
 
 def store_actor(actor: Actor):
     actors = get_actors_confobj()
+    finance_channel_id = str(actor.finance_channel_id)
     actors[actor.actor_id] = actor.to_string()
-    actors[finance_channel_mapping_index][str(actor.finance_channel_id)] = (
-        actor.actor_id
-    )
+    actors[finance_channel_mapping_index][finance_channel_id] = actor.actor_id
     actors.write()
+    _unindex_actor(actor.actor_id)
+    _index_actor(copy(actor))
+    actor_ids_by_finance_channel[finance_channel_id] = actor.actor_id
 
 
 def read_actor(actor_id: str):
-    if actor_id in get_all_actor_ids():
-        actors = get_actors_confobj()
-        return Actor.from_string(actors[actor_id])
+    get_actors_confobj()
+    actor = actors_by_id.get(actor_id)
+    if actor is not None:
+        # A copy, so that changes only count once they are stored
+        return copy(actor)
 
 
 def get_owner_of_finance_channel(channel_id: str):
-    actors = get_actors_confobj()
-    if channel_id in actors[finance_channel_mapping_index]:
-        return actors[finance_channel_mapping_index][channel_id]
+    get_actors_confobj()
+    return actor_ids_by_finance_channel.get(channel_id)
 
 
 recent_transactions_suffix = "_recent_trans.conf"
@@ -323,7 +373,7 @@ async def update_financial_statement(channel, actor: Actor):
     if message is not None:
         await message.delete()
 
-    report = finances.get_all_handles_balance_report(actor.actor_id)
+    report = await finances.get_all_handles_balance_report(actor.actor_id)
     content = "========================\n" + report
 
     new_message = await channel.send(content)
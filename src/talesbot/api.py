@@ -1,9 +1,12 @@
 import logging
+from typing import Annotated
+from uuid import uuid4
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, Request, Response
 from pydantic import BaseModel
 
-from talesbot import finances, utils
+from talesbot import finances, reactions, utils
+from talesbot.errors import ReportError
 
 logger = logging.getLogger(__name__)
 
@@ -12,10 +15,35 @@ app = FastAPI()
 
 @app.get("/api/balance/{handle}")
 async def balance(handle: str):
-    amount = finances.get_current_balance_handle_id(handle)
+    amount = await finances.get_current_balance_handle_id(handle)
     return {"amount": amount}
 
 
+@app.get("/api/stats/reactions")
+async def reaction_stats():
+    return reactions.get_reaction_stats()
+
+
+# Changes with every restart, since the ledger version starts over from 0
+etag_prefix = uuid4().hex[:8]
+
+
+@app.get("/api/balances")
+async def balances(
+    request: Request,
+    response: Response,
+    handle: Annotated[list[str] | None, Query()] = None,
+):
+    # All balances, or those of the handles given as ?handle=a&handle=b.
+    # Pollers that send back the ETag get a 304 until the ledger changes.
+    etag = f'"{etag_prefix}-{finances.ledger_version}"'
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return {"balances": await finances.get_balances(handle)}
+
+
 class Transfer(BaseModel):
     sender: str | None = None
     receiver: str | None = None
@@ -45,3 +73,30 @@ async def transfer(data: Transfer):
             f"{utils.fmt_handle(data.sender)} to {utils.fmt_handle(data.sender)}"
         )
         return {"status": "error", "msg": str(e)}
+
+
+@app.post("/api/transfers/batch")
+async def transfer_batch(transfers: list[Transfer], atomic: bool = False):
+    logger.info(
+        f"Applying a batch of {len(transfers)} transfers"
+        + (" (all or nothing)" if atomic else "")
+    )
+    try:
+        results = await finances.transfer_funds_batch(
+            [(t.sender, t.receiver, t.amount, t.allow_partial) for t in transfers],
+            atomic=atomic,
+        )
+    except Exception as e:
+        logger.exception(f"Failed applying a batch of {len(transfers)} transfers")
+        return {"status": "error", "message": str(e)}
+
+    items = []
+    for result in results:
+        if isinstance(result, ReportError):
+            items.append({"status": "error", "message": str(result)})
+        else:
+            items.append(
+                {"status": "ok", "message": result.report, "amount": result.amount}
+            )
+    failed = any(item["status"] == "error" for item in items)
+    return {"status": "error" if atomic and failed else "ok", "results": items}
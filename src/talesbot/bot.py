@@ -7,7 +7,7 @@ import discord
 from discord.abc import GuildChannel
 from discord.app_commands import BotMissingPermissions
 from discord.app_commands.errors import AppCommandError, CommandInvokeError, MissingRole
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from talesbot import (
     actors,
@@ -23,9 +23,12 @@ from talesbot import (
     reactions,
     server,
     shops,
+    snapshot,
 )
 from talesbot.config import config
 from talesbot.errors import ReportError
+from talesbot.startup import Startup
+from talesbot.ui.chat_history import disable_open_history_views
 from talesbot.ui.register import RegisterView
 
 clear_all = config.CLEAR_ALL
@@ -92,11 +95,40 @@ class TalesBot(commands.Bot):
         self.inital_extensions = inital_extensions
 
     async def setup_hook(self) -> None:
+        snapshot.load()
         self.add_view(RegisterView())
 
         for ext in self.inital_extensions:
             await self.load_extension(ext)
 
+        self.flush_state.start()
+
+    async def close(self) -> None:
+        self.flush_state.cancel()
+        await reactions.settle_all_reaction_payments()
+        channels.flush_channel_states()
+        # Only runs once startup has completed, before that there is nothing to save
+        if self.write_snapshot.is_running():
+            self.write_snapshot.cancel()
+            self.save_snapshot()
+        await disable_open_history_views()
+        await super().close()
+
+    @tasks.loop(seconds=channels.state_flush_interval)
+    async def flush_state(self):
+        # Write-behind for the state that is only kept in memory between flushes
+        channels.flush_channel_states()
+
+    @tasks.loop(seconds=snapshot.snapshot_interval)
+    async def write_snapshot(self):
+        self.save_snapshot()
+
+    def save_snapshot(self):
+        # Shop files with changes waiting in a batch are loaded from disk next time
+        snapshot.write(
+            skip=[conf.filename for conf in shops.changed_shop_files.values()]
+        )
+
     async def on_guild_available(self, guild: discord.Guild):
         logger.info(f"Connected to guild {guild.name}")
         self.tree.copy_global_to(guild=guild)
@@ -111,19 +143,55 @@ class TalesBot(commands.Bot):
             return
 
         # TODO: move some of the initialisation to the cogs instead
-        await server.init(self.guilds)
-        await handles.init(clear_all)
-        await actors.init(clear_all=clear_all)
-        await players.init(clear_all=clear_all)
+        # The phases that create or delete channels (shops, players, actors,
+        # channels, chats, groups, gm) run one after another, in the order they
+        # always have, since each of them walks channels the others may delete
+        # Every phase that opens ledger accounts waits for the ledger migration
+        startup = Startup()
+        startup.add("server", lambda: server.init(self.guilds))
+        startup.add("ledger", finances.migrate_finances_confs)
+        startup.add("handles", lambda: handles.init(clear_all), after=["ledger"])
         if not config.SKIP_CHANNELS:
-            await channels.init(self)
-        finances.init_finances()
-        await chats.init(clear_all=clear_all)
-        await shops.init(clear_all=clear_all)
-        await groups.init(clear_all=clear_all)
-        reactions.init()
-        await gm.init(clear_all=clear_all)
-        game.init()
+            startup.add(
+                "channels", lambda: channels.init(self), after=["server", "actors"]
+            )
+        startup.add("reactions", reactions.init)
+        startup.add(
+            "shops",
+            lambda: shops.init(clear_all=clear_all),
+            after=["server", "handles", "ledger"],
+        )
+        startup.add(
+            "players",
+            lambda: players.init(clear_all=clear_all),
+            after=["shops", "ledger"],
+        )
+        startup.add(
+            "actors",
+            lambda: actors.init(clear_all=clear_all, with_shops_and_players=False),
+            after=["players", "ledger"],
+        )
+        startup.add("finances", finances.init_finances, after=["actors", "ledger"])
+        startup.add(
+            "chats",
+            lambda: chats.init(clear_all=clear_all),
+            after=["actors", "channels"],
+        )
+        startup.add(
+            "groups",
+            lambda: groups.init(clear_all=clear_all),
+            after=["actors", "channels", "chats"],
+        )
+        startup.add(
+            "gm",
+            lambda: gm.init(clear_all=clear_all),
+            after=["actors", "channels", "finances", "groups"],
+        )
+        startup.add("game", game.init, after=["gm"])
+        await startup.run()
+        logger.info(f"Loaded config files: {dict(snapshot.conf_loads)}")
+        if not self.write_snapshot.is_running():
+            self.write_snapshot.start()
         logger.debug("Initialization complete.")
         game.start_game()
 
@@ -205,14 +273,32 @@ class TalesBot(commands.Bot):
             # Don't act on bot's own reactions to avoid loops
             return
 
-        channel = await self.fetch_channel(payload.channel_id)
+        channel = await channels.resolve_channel(self, payload.channel_id)
         if channels.is_offline_channel(channel):
             # No bot shenanigans in the off channels
             return
 
-        await reactions.process_reaction_add(
-            payload.message_id, payload.user_id, channel, payload.emoji
+        context = reactions.ReactionContext(
+            payload.message_id,
+            payload.user_id,
+            channel,
+            payload.emoji,
+            member=payload.member,
+            cached_message=discord.utils.get(
+                self.cached_messages, id=payload.message_id
+            ),
         )
+        await reactions.process_reaction_add(context)
+
+    async def on_guild_channel_create(self, channel: GuildChannel):
+        server.index_channel(channel)
+
+    async def on_guild_channel_delete(self, channel: GuildChannel):
+        server.unindex_channel(channel)
+
+    async def on_guild_channel_update(self, before: GuildChannel, after: GuildChannel):
+        if before.name != after.name:
+            server.reindex_channel(before, after)
 
     async def on_member_join(self, member: discord.Member):
         await server.set_user_as_new_player(member)
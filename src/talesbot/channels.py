@@ -2,6 +2,7 @@ import asyncio
 import datetime
 import logging
 import os
+from collections import Counter
 from typing import Optional
 
 import discord
@@ -39,8 +40,14 @@ post_counter_index = "___post_counter"
 slowmode_delay: int = 2
 
 # Channel state: this is the state of the channel, independent of the handles used in it.
+# It is read and updated on every post, so it is kept in memory and only written to
+# channel_states.conf by flush_channel_states(), for the channels that changed since
+# the last flush. The bot flushes every state_flush_interval seconds and on shutdown.
 
 channel_states = ConfigObj(str(config_dir / "channel_states.conf"))
+channel_state_cache: dict[str, "ChannelState"] = {}
+dirty_channel_states: set[str] = set()
+state_flush_interval: int = 10
 logger = logging.getLogger(__name__)
 
 type VocalGuildChannel = discord.VoiceChannel | discord.StageChannel
@@ -52,6 +59,76 @@ type GuildChannel = (
 )
 
 
+### Channel state:
+
+
+class ChannelState:
+    __slots__ = ("last_poster", "last_full_post", "post_counter")
+
+    def __init__(
+        self,
+        last_poster: str = "",
+        last_full_post: Optional[PostTimestamp] = None,
+        post_counter: int = 0,
+    ):
+        self.last_poster = last_poster
+        self.last_full_post = last_full_post
+        self.post_counter = post_counter
+
+    @staticmethod
+    def from_section(section):
+        last_full_post = section.get(last_full_post_index)
+        return ChannelState(
+            section.get(last_poster_index, ""),
+            None
+            if last_full_post is None
+            else PostTimestamp.from_string(last_full_post),
+            int(section.get(post_counter_index, 0)),
+        )
+
+    def to_section(self):
+        section = {
+            last_poster_index: self.last_poster,
+            post_counter_index: str(self.post_counter),
+        }
+        if self.last_full_post is not None:
+            section[last_full_post_index] = self.last_full_post.to_string()
+        return section
+
+
+def _get_channel_state(channel_name: str) -> ChannelState:
+    state = channel_state_cache.get(channel_name)
+    if state is None:
+        section = channel_states.get(channel_name)
+        state = (
+            ChannelState() if section is None else ChannelState.from_section(section)
+        )
+        channel_state_cache[channel_name] = state
+    return state
+
+
+def _reset_channel_state(channel_name: str):
+    channel_state_cache[channel_name] = ChannelState()
+    dirty_channel_states.add(channel_name)
+
+
+def clear_channel_states():
+    channel_state_cache.clear()
+    dirty_channel_states.clear()
+    for elem in channel_states:
+        del channel_states[elem]
+    channel_states.write()
+
+
+def flush_channel_states():
+    if not dirty_channel_states:
+        return
+    for channel_name in dirty_channel_states:
+        channel_states[channel_name] = channel_state_cache[channel_name].to_section()
+    dirty_channel_states.clear()
+    channel_states.write()
+
+
 ### Utilities:
 
 
@@ -154,6 +231,21 @@ def get_discord_channel(channel_id: str, guild_id: Optional[int] = None):
                 return ch
 
 
+# How often resolve_channel() found the channel in the gateway cache ("hit")
+# or had to fetch it ("miss")
+channel_lookups: Counter[str] = Counter()
+
+
+async def resolve_channel(client: discord.Client, channel_id: int):
+    # Gateway cache first, REST only for channels the cache does not know about
+    channel = client.get_channel(channel_id)
+    if channel is not None:
+        channel_lookups["hit"] += 1
+        return channel
+    channel_lookups["miss"] += 1
+    return await client.fetch_channel(channel_id)
+
+
 async def delete_discord_channel(channel_id: str, guild_id: Optional[int] = None):
     channel = get_discord_channel(channel_id, guild_id)
     if channel is not None:
@@ -167,9 +259,7 @@ async def delete_discord_channel(channel_id: str, guild_id: Optional[int] = None
 
 
 async def init(bot: commands.Bot):
-    for elem in channel_states:
-        del channel_states[elem]
-    channel_states.write()
+    clear_channel_states()
 
     logger.debug(f"Init channels for {len(bot.guilds)} guilds")
     for guild in bot.guilds:
@@ -231,7 +321,7 @@ async def _verify_category_exists(
 ):
     if category_name not in [cat.name for cat in guild.categories]:
         logger.debug(f"Did not find category {category_name}, will create it")
-        await guild.create_category(category_name)
+        server.index_channel(await guild.create_category(category_name))
     else:
         logger.debug(f"Category already exists {guild.name}:{category_name}")
 
@@ -244,18 +334,15 @@ async def _verify_category_exists(
 
 async def _verify_channel_exists(category: discord.CategoryChannel, channel_name: str):
     if channel_name not in [ch.name for ch in category.channels]:
-        await category.create_text_channel(channel_name)
+        server.index_channel(await category.create_text_channel(channel_name))
     else:
         logger.debug(f"Channel already exists {category.guild.name}:{channel_name}")
 
 
 async def _init_channel_state(discord_channel: GuildChannel):
     await discord_channel.edit(slowmode_delay=slowmode_delay)
-    channel_name = discord_channel.name
-    channel_states[
-        channel_name
-    ] = {}  # TODO: How does this work with guilds joining on-the-fly?
-    channel_states.write()
+    # TODO: How does this work with guilds joining on-the-fly?
+    _reset_channel_state(discord_channel.name)
 
 
 async def _set_base_permissions(
@@ -337,31 +424,19 @@ def get_public_anon_channels():
 
 
 def _init_pseudonymous_channel(channel_name: str):
-    _set_last_poster(channel_name, "")
-    timestamp: PostTimestamp = PostTimestamp.from_datetime(datetime.datetime.today())
-    _set_last_full_post(channel_name, timestamp)
-    _reset_post_counter(channel_name)
-
-
-def _set_last_poster(channel_name: str, poster_id: str):
-    channel_states[channel_name][last_poster_index] = poster_id
-    channel_states.write()
+    state = _get_channel_state(channel_name)
+    state.last_poster = ""
+    state.last_full_post = PostTimestamp.from_datetime(datetime.datetime.today())
+    state.post_counter = 0
+    dirty_channel_states.add(channel_name)
 
 
 def _get_last_poster(channel_name: str):
-    if last_poster_index not in channel_states[channel_name]:
-        return ""
-    else:
-        return channel_states[channel_name][last_poster_index]
+    return _get_channel_state(channel_name).last_poster
 
 
 def _get_last_post_time(channel_name: str):
-    return PostTimestamp.from_string(channel_states[channel_name][last_full_post_index])
-
-
-def _set_last_full_post(channel_name: str, timestamp: PostTimestamp):
-    channel_states[channel_name][last_full_post_index] = timestamp.to_string()
-    channel_states.write()
+    return _get_channel_state(channel_name).last_full_post
 
 
 def _time_has_passed_since_last_full_post(channel_name: str, timestamp):
@@ -370,30 +445,19 @@ def _time_has_passed_since_last_full_post(channel_name: str, timestamp):
     return post_time != old_time
 
 
-def _increment_post_counter(channel_name: str):
-    count = int(channel_states[channel_name][post_counter_index])
-    count += 1
-    channel_states[channel_name][post_counter_index] = str(count)
-    channel_states.write()
-    return count >= 10
-
-
-def _reset_post_counter(channel_name: str):
-    channel_states[channel_name][post_counter_index] = str(0)
-    channel_states.write()
-
-
 # Returns True if the new post should be a full post (with sender and timestamp header)
 # Returns False if the new post should only include the content itself
 def record_new_post(channel_name: str, poster_id: str, timestamp: PostTimestamp):
-    last_poster = _get_last_poster(channel_name)
+    state = _get_channel_state(channel_name)
     time_has_passed = _time_has_passed_since_last_full_post(channel_name, timestamp)
-    counter_has_passed_limit = _increment_post_counter(channel_name)
-
-    if last_poster != poster_id or time_has_passed or counter_has_passed_limit:
-        _set_last_poster(channel_name, poster_id)
-        _set_last_full_post(channel_name, timestamp)
-        _reset_post_counter(channel_name)
+    state.post_counter += 1
+    counter_has_passed_limit = state.post_counter >= 10
+    dirty_channel_states.add(channel_name)
+
+    if state.last_poster != poster_id or time_has_passed or counter_has_passed_limit:
+        state.last_poster = poster_id
+        state.last_full_post = timestamp
+        state.post_counter = 0
         return True
 
     return False
@@ -415,6 +479,9 @@ async def create_discord_channel(
         category=category,
         slowmode_delay=slowmode_delay,
     )
+    # Indexed right away, not only once the gateway event for it arrives, so that
+    # a lookup by name straight after this finds it
+    server.index_channel(channel)
     await _init_channel_state(channel)
     return channel
 
@@ -545,8 +612,7 @@ async def get_all_groups_channels(channel_suffix: str = None):
 
 
 def init_chat_channel(channel_name: str):
-    channel_states[channel_name] = {}
-    channel_states.write()
+    _reset_channel_state(channel_name)
     _init_pseudonymous_channel(channel_name)
 
 
@@ -0,0 +1,121 @@
+import os
+from array import array
+from collections.abc import Iterator
+
+### Module chat_log.py
+# Append-only storage for the history of a chat.
+# The log is a JSON Lines file where line N holds entry N, next to an index file
+# with the byte offset of every line. Appending an entry is a single write to each
+# file, and any entry (or the tail of the log) can be read without touching the rest.
+# Removed entries are blanked in place, so the offsets of later entries never move.
+
+removed_entry = b"null"
+
+
+class ChatLog:
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.index_file_name = f"{file_name}.idx"
+        self.offsets = array("Q")
+        self.size = 0
+        self.load_index()
+
+    def load_index(self):
+        self.offsets = array("Q")
+        self.size = (
+            os.path.getsize(self.file_name) if os.path.exists(self.file_name) else 0
+        )
+        if self.size == 0:
+            # Drop any index left behind by a log that was never written
+            if os.path.exists(self.index_file_name):
+                os.remove(self.index_file_name)
+            return
+        if os.path.exists(self.index_file_name):
+            index_size = os.path.getsize(self.index_file_name)
+            with open(self.index_file_name, "rb") as f:
+                self.offsets.fromfile(f, index_size // self.offsets.itemsize)
+        if not self.index_matches_log():
+            self.rebuild_index()
+
+    def index_matches_log(self):
+        # A crash between writing the log and the index leaves them out of step
+        if len(self.offsets) == 0 or self.offsets[-1] >= self.size:
+            return False
+        with open(self.file_name, "rb") as f:
+            f.seek(self.offsets[-1])
+            last_line = f.read()
+        return last_line.count(b"\n") == 1 and last_line.endswith(b"\n")
+
+    def rebuild_index(self):
+        self.offsets = array("Q")
+        offset = 0
+        with open(self.file_name, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Half-written last entry, it is cut off below
+                    break
+                self.offsets.append(offset)
+                offset += len(line)
+        if offset != self.size:
+            with open(self.file_name, "r+b") as f:
+                f.truncate(offset)
+            self.size = offset
+        with open(self.index_file_name, "wb") as f:
+            self.offsets.tofile(f)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, entry: str) -> int:
+        # Returns the index of the new entry
+        line = entry.encode("utf-8") + b"\n"
+        with open(self.file_name, "ab") as f:
+            f.write(line)
+        index = len(self.offsets)
+        self.offsets.append(self.size)
+        with open(self.index_file_name, "ab") as f:
+            self.offsets[index:].tofile(f)
+        self.size += len(line)
+        return index
+
+    def _line_length(self, index: int):
+        end = self.offsets[index + 1] if index + 1 < len(self.offsets) else self.size
+        return end - self.offsets[index]
+
+    def read(self, index: int) -> str | None:
+        # Returns None for removed entries
+        if index < 0 or index >= len(self.offsets):
+            return None
+        with open(self.file_name, "rb") as f:
+            f.seek(self.offsets[index])
+            line = f.read(self._line_length(index)).rstrip()
+        return None if line == removed_entry else line.decode("utf-8")
+
+    def remove(self, index: int):
+        if index < 0 or index >= len(self.offsets):
+            return
+        length = self._line_length(index)
+        with open(self.file_name, "r+b") as f:
+            f.seek(self.offsets[index])
+            f.write(removed_entry.ljust(length - 1) + b"\n")
+
+    def entries(
+        self, start: int = 0, stop: int | None = None
+    ) -> Iterator[tuple[int, str]]:
+        # Streams (index, entry) from start up to stop, skipping removed entries
+        stop = len(self.offsets) if stop is None else min(stop, len(self.offsets))
+        if start >= stop:
+            return
+        with open(self.file_name, "rb") as f:
+            f.seek(self.offsets[start])
+            for index in range(start, stop):
+                line = f.readline().rstrip()
+                if line != removed_entry:
+                    yield (index, line.decode("utf-8"))
+
+    def clear(self):
+        for file_name in [self.file_name, self.index_file_name]:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+        self.offsets = array("Q")
+        self.size = 0
@@ -1,5 +1,7 @@
 import asyncio
 import logging
+import os
+import time
 from enum import Enum
 
 import discord
@@ -11,6 +13,7 @@ from discord.ext import commands
 from talesbot import checks, gm
 
 from . import actors, channels, game, handles, players, posting
+from .chat_log import ChatLog, removed_entry
 from .common import (
     emoji_cancel,
     emoji_green,
@@ -22,6 +25,8 @@ from .common import (
 )
 from .config import config_dir
 from .custom_types import Handle, PostTimestamp
+from .journal import JournaledDict
+from .ui.chat_history import ChatHistoryView
 
 ### Module chats.py
 # This module handles chats between handles
@@ -178,13 +183,24 @@ class ChatsCog(commands.Cog, name="chats"):
 
 
 chats_dir = "chats"
-chats = ConfigObj(str(config_dir / chats_dir / "chats.conf"))
+
+
+# The chat indexes are kept in memory and every change is appended to their files:
+# - guild#channel ID -> the chat connection of that channel
+# - chat hub message ID -> the chat connection of that message
+# - chat name -> number of entries in its log (every chat that exists is in here)
+def get_chat_index(name: str):
+    return JournaledDict(str(config_dir / chats_dir / f"{name}.jsonl"))
+
+
+chat_channel_connections = get_chat_index("chat_channels")
+chat_hub_msg_connections = get_chat_index("chat_hub_msgs")
+chat_log_lengths = get_chat_index("chat_log_lengths")
 
 
 async def setup(bot):
-    global chats
     await bot.add_cog(ChatsCog(bot))
-    chats = ConfigObj(str(config_dir / chats_dir / "chats.conf"))
+    load_chat_indexes()
 
 
 channel_limit_per_actor = 5
@@ -216,6 +232,7 @@ class ChatParticipant:
         handle: str,  # TODO: rename handle_id
         chat_hub_msg_id: str,
         channel_id: str = None,
+        closed_log_index: int = None,
     ):
         self.chat_name = chat_name
         self.session_status = session_status
@@ -227,6 +244,8 @@ class ChatParticipant:
         self.chat_hub_msg_id = chat_hub_msg_id
         # Set to None when the channel is temporarily closed
         self.channel_id = channel_id
+        # Where in the chat log this participant last closed the session, if they did
+        self.closed_log_index = closed_log_index
 
     @staticmethod
     def from_string(string: str):
@@ -308,16 +327,29 @@ class Activation(str, Enum):
     Open = "open"
 
 
-def init_chats_confobj():
-    global chats
-    chats = ConfigObj(str(config_dir / chats_dir / "chats.conf"))
-    if chat_channel_data_index not in chats:
-        chats[chat_channel_data_index] = {}
-    if chat_hub_msg_data_index not in chats:
-        chats[chat_hub_msg_data_index] = {}
-    if chats_with_logs_index not in chats:
-        chats[chats_with_logs_index] = {}
-    chats.write()
+def load_chat_indexes():
+    global chat_channel_connections, chat_hub_msg_connections, chat_log_lengths
+    chat_channel_connections = get_chat_index("chat_channels")
+    chat_hub_msg_connections = get_chat_index("chat_hub_msgs")
+    chat_log_lengths = get_chat_index("chat_log_lengths")
+    migrate_chats_conf()
+
+
+def migrate_chats_conf():
+    # One-shot import from the shared chats.conf that used to hold all three indexes.
+    # The file is renamed afterwards so that it is never read again.
+    file_name = str(config_dir / chats_dir / "chats.conf")
+    if not os.path.exists(file_name):
+        return
+    chats = ConfigObj(file_name)
+    for index, chat_index in [
+        (chat_channel_data_index, chat_channel_connections),
+        (chat_hub_msg_data_index, chat_hub_msg_connections),
+        (chats_with_logs_index, chat_log_lengths),
+    ]:
+        if index in chats:
+            chat_index.update({key: str(value) for key, value in chats[index].items()})
+    os.replace(file_name, f"{file_name}.migrated")
 
 
 def get_channel_budget():
@@ -325,48 +357,92 @@ def get_channel_budget():
 
 
 def dump():
-    for cat in chats:
+    for cat, chat_index in [
+        (chat_channel_data_index, chat_channel_connections),
+        (chat_hub_msg_data_index, chat_hub_msg_connections),
+        (chats_with_logs_index, chat_log_lengths),
+    ]:
         logger.debug(f"Dumping category {cat}:")
-        for entry in chats[cat]:
-            logger.debug(f"Entry {entry}: {chats[cat][entry]}")
+        for entry, value in chat_index.items():
+            logger.debug(f"Entry {entry}: {value}")
+
+
+# At startup, open chat sessions are closed with at most this many in flight.
+# Closing a session deletes its channel and edits a chat hub message.
+chat_teardown_concurrency = 10
+# Progress of closing the sessions is logged every this many sessions
+chat_teardown_log_interval = 50
 
 
 async def init(clear_all: bool = False):
-    init_chats_confobj()
+    open_sessions = []
     # Loop through all chats that are supposed to exist according to conf files
-    for chat_name in chats[chats_with_logs_index]:
+    for chat_name in chat_log_lengths:
         chat_state = get_chat_state(chat_name)
         if clear_all:
-            del chat_state[chat_participants_index]
-            del chat_state[chat_content_index]
+            for index in [chat_participants_index, chat_content_index]:
+                if index in chat_state:
+                    del chat_state[index]
             chat_state.write()
+            get_chat_log(chat_name, migrate=False).clear()
         else:
             # Re-init the chats (posting-wise) like any open channel
             channels.init_chat_channel(chat_name)
             # Keep the participants data but reset the channel IDs, to indicate that all discord channels are deleted
             if chat_participants_index not in chat_state:
                 init_chat_state(chat_state)
-            for participant in get_participants(chat_state):
-                # Close all chat sessions. If the discord and config files are still in sync,
-                # this will update all chat hub messages so that chats can be easily re-opened
-                await close_chat_session(participant)
+            # Close all chat sessions. If the discord and config files are still in sync,
+            # this will update all chat hub messages so that chats can be easily re-opened
+            open_sessions.extend(
+                participant
+                for participant in get_participants(chat_state)
+                if participant.session_status
+                in [session_status_active, session_status_open_archive]
+            )
+    await close_chat_sessions(open_sessions)
     # Remove all channel mappings
-    chats[chat_channel_data_index] = {}
+    chat_channel_connections.clear()
     if clear_all:
-        chats[chat_hub_msg_data_index] = {}
-        chats[chats_with_logs_index] = {}
+        chat_hub_msg_connections.clear()
+        chat_log_lengths.clear()
         channel_list = await channels.get_all_chat_hub_channels()
         await asyncio.gather(*[asyncio.create_task(c.purge()) for c in channel_list])
 
     # Any left-over channels after this should be deleted
     await channels.delete_all_chats()
 
+    # All sessions are closed, so nobody uses any of their channel budget
     chat_channel_budget = get_channel_budget()
-    for actor_id in chat_channel_budget:
-        del chat_channel_budget[actor_id]
-        chat_channel_budget.write()
-
-    chats.write()
+    chat_channel_budget.clear()
+    chat_channel_budget.write()
+
+
+async def close_chat_sessions(participants: list[ChatParticipant]):
+    # The channel budget is reset by the caller, so it is not updated per session
+    start = time.perf_counter()
+    limiter = asyncio.Semaphore(chat_teardown_concurrency)
+    done = 0
+    failed = 0
+
+    async def close(participant: ChatParticipant):
+        nonlocal done, failed
+        async with limiter:
+            try:
+                await close_chat_session(participant, update_budget=False)
+            except Exception:
+                failed += 1
+                logger.exception(
+                    f"Failed to close {participant.chat_name} for {participant.handle}"
+                )
+            done += 1
+            if done % chat_teardown_log_interval == 0:
+                logger.info(f"Closed {done}/{len(participants)} chat sessions")
+
+    await asyncio.gather(*(close(participant) for participant in participants))
+    logger.info(
+        f"Closed {done - failed} chat sessions in {time.perf_counter() - start:.1f} s"
+        + (f", {failed} failed" if failed else "")
+    )
 
 
 def create_2party_chat_name(handle1: Handle, handle2: Handle):
@@ -379,12 +455,9 @@ def _get_chat_connection_key(guild_id: int, channel_id: str):
 
 
 def read_chat_connection_from_channel(guild_id: int, channel_id: str):
-    init_chats_confobj()
-    chats = ConfigObj(str(config_dir / chats_dir / "chats.conf"))
-
     key = _get_chat_connection_key(guild_id, channel_id)
-    if key in chats[chat_channel_data_index]:
-        string = chats[chat_channel_data_index][key]
+    if key in chat_channel_connections:
+        string = chat_channel_connections[key]
         chat_connection: ChatConnectionMapping = ChatConnectionMapping.from_string(
             string
         )
@@ -396,25 +469,20 @@ def read_chat_connection_from_channel(guild_id: int, channel_id: str):
 def store_chat_connection_for_channel(
     guild_id: int, channel_id: str, chat_connection: ChatConnectionMapping
 ):
-    init_chats_confobj()
     key = _get_chat_connection_key(guild_id, channel_id)
-    chats[chat_channel_data_index][key] = chat_connection.to_string()
-    chats.write()
+    chat_channel_connections[key] = chat_connection.to_string()
 
 
 def clear_channel_connection_mappings(guild_id: int, channel_id: str):
-    init_chats_confobj()
     key = _get_chat_connection_key(guild_id, channel_id)
-    if key in chats[chat_channel_data_index]:
-        del chats[chat_channel_data_index][key]
-        chats.write()
+    if key in chat_channel_connections:
+        del chat_channel_connections[key]
 
 
 def read_chat_connection_from_hub_msg(msg_id: str):
-    init_chats_confobj()
     # TODO: Guard msg_id with guild_id too?
-    if msg_id in chats[chat_hub_msg_data_index]:
-        string = chats[chat_hub_msg_data_index][msg_id]
+    if msg_id in chat_hub_msg_connections:
+        string = chat_hub_msg_connections[msg_id]
         chat_connection: ChatConnectionMapping = ChatConnectionMapping.from_string(
             string
         )
@@ -426,21 +494,16 @@ def read_chat_connection_from_hub_msg(msg_id: str):
 def store_chat_connection_for_hub_msg(
     msg_id: str, chat_connection: ChatConnectionMapping
 ):
-    init_chats_confobj()
-    chats[chat_hub_msg_data_index][msg_id] = chat_connection.to_string()
-    chats.write()
+    chat_hub_msg_connections[msg_id] = chat_connection.to_string()
 
 
 def clear_hub_msg_connection_mapping(msg_id):
-    init_chats_confobj()
-    if msg_id in chats[chat_hub_msg_data_index]:
-        del chats[chat_hub_msg_data_index][msg_id]
-        chats.write()
+    if msg_id in chat_hub_msg_connections:
+        del chat_hub_msg_connections[msg_id]
 
 
 def chat_exists(chat_name: str):
-    init_chats_confobj()
-    return chat_name in chats[chats_with_logs_index]
+    return chat_name in chat_log_lengths
 
 
 def get_chat_state(chat_name: str):
@@ -449,11 +512,8 @@ def get_chat_state(chat_name: str):
 
 
 def get_chats_for_handle(handle: Handle):
-    init_chats_confobj()
-    for msg_id in chats[chat_hub_msg_data_index]:
-        chat_connection: ChatConnectionMapping = read_chat_connection_from_hub_msg(
-            msg_id
-        )
+    for string in chat_hub_msg_connections.values():
+        chat_connection = ChatConnectionMapping.from_string(string)
         if chat_connection.handle == handle.handle_id:
             yield (chat_connection.chat_name, get_chat_state(chat_connection.chat_name))
 
@@ -479,53 +539,61 @@ def store_participant(chat_name: str, participant: ChatParticipant):
 
 
 def get_log_length(chat_name: str):
-    init_chats_confobj()
-    return int(chats[chats_with_logs_index][chat_name])
+    return int(chat_log_lengths[chat_name])
 
 
-def increment_log_length(chat_name: str):
-    init_chats_confobj()
-    prev_length = int(chats[chats_with_logs_index][chat_name])
-    chats[chats_with_logs_index][chat_name] = str(prev_length + 1)
-    chats.write()
+def set_log_length(chat_name: str, length: int):
+    chat_log_lengths[chat_name] = str(length)
 
 
-# TODO: move the chat log to a separate file, so that writing an entry
-# and opening/closing a sesson don't need to interfere
+chat_logs: dict[str, ChatLog] = {}
 
 
-def read_chat_log_entry(chat_state, index: int):
-    string = chat_state[chat_content_index][str(index)]
-    return ChatLogEntry.from_string(string)
+def get_chat_log(chat_name: str, migrate: bool = True):
+    if chat_name not in chat_logs:
+        chat_log = ChatLog(str(config_dir / chats_dir / f"{chat_name}.log.jsonl"))
+        if migrate:
+            migrate_chat_content(chat_name, chat_log)
+        chat_logs[chat_name] = chat_log
+    return chat_logs[chat_name]
 
 
-def get_chat_log_iterable(chat_state, chat_name: str):
-    log_length = get_log_length(chat_name)
-    for index in range(log_length):
-        index_str = str(index)
-        if index_str in chat_state[chat_content_index]:
-            yield (index, read_chat_log_entry(chat_state, index))
-
-
-def store_chat_log_entry(chat_name: str, index: int, entry: ChatLogEntry):
+def migrate_chat_content(chat_name: str, chat_log: ChatLog):
+    # One-shot move of the history out of <chat>.conf, where it used to be stored
     chat_state = get_chat_state(chat_name)
-    chat_state[chat_content_index][str(index)] = entry.to_string()
+    content = chat_state.get(chat_content_index)
+    if content is None:
+        return
+    if len(chat_log) == 0 and len(content) > 0:
+        for index in range(max(int(i) for i in content) + 1):
+            # Removed entries are kept as blanks, so that the indexes stay the same
+            chat_log.append(content.get(str(index), removed_entry.decode()))
+        set_log_length(chat_name, len(chat_log))
+    del chat_state[chat_content_index]
     chat_state.write()
 
 
+def read_chat_log_entry(chat_name: str, index: int):
+    string = get_chat_log(chat_name).read(index)
+    return ChatLogEntry.from_string(string) if string is not None else None
+
+
+def get_chat_log_iterable(chat_name: str, start: int = 0):
+    # Streams the log from the file, one entry at a time
+    for index, string in get_chat_log(chat_name).entries(start):
+        yield (index, ChatLogEntry.from_string(string))
+
+
 def remove_entry_from_chat_log(chat_name: str, index: int):
-    # Re-read the log (minimize time between read and write)
-    chat_state = get_chat_state(chat_name)
-    index_str = str(index)
-    if index_str in chat_state[chat_content_index]:
-        del chat_state[chat_content_index][index_str]
-        chat_state.write()
+    get_chat_log(chat_name).remove(index)
 
 
 def write_new_chat_log_entry(chat_name: str, entry: ChatLogEntry):
-    next_index = get_log_length(chat_name)
-    store_chat_log_entry(chat_name, next_index, entry)
-    increment_log_length(chat_name)
+    # Returns the index of the new entry
+    chat_log = get_chat_log(chat_name)
+    index = chat_log.append(entry.to_string())
+    set_log_length(chat_name, len(chat_log))
+    return index
 
 
 def get_participant_handle_ids(channel):
@@ -540,10 +608,9 @@ def get_participant_handle_ids(channel):
 
 # Returns True if the chat was newly created, False if it already existed
 def init_chat_log(chat_name: str):
-    init_chats_confobj()
-    if chat_name not in chats[chats_with_logs_index]:
-        chats[chats_with_logs_index][chat_name] = 0
-        chats.write()
+    if chat_name not in chat_log_lengths:
+        chat_log_lengths[chat_name] = "0"
+        get_chat_log(chat_name, migrate=False).clear()
         chat_state = get_chat_state(chat_name)
         init_chat_state(chat_state)
         return True
@@ -554,7 +621,6 @@ def init_chat_log(chat_name: str):
 def init_chat_state(chat_state):
     if chat_participants_index not in chat_state:
         chat_state[chat_participants_index] = {}
-        chat_state[chat_content_index] = {}
         chat_state.write()
     else:
         logger.debug(
@@ -563,8 +629,7 @@ def init_chat_state(chat_state):
 
 
 def get_chat_log_length(chat_name):
-    init_chats_confobj()
-    return int(chats[chats_with_logs_index][chat_name])
+    return int(chat_log_lengths[chat_name])
 
 
 ### The channel budget
@@ -1076,7 +1141,7 @@ async def close_2party_chat_session(my_handle: Handle, partner_handle_id: str):
         return failure_report
 
 
-async def close_chat_session(participant: ChatParticipant):
+async def close_chat_session(participant: ChatParticipant, update_budget=True):
     logger.debug(f"Trying to close {participant.chat_name}, for {participant.handle}")
 
     # update chat -> channel ID mapping
@@ -1095,7 +1160,8 @@ async def close_chat_session(participant: ChatParticipant):
             + "but channel ID is missing. Dump: {participant.to_string()}"
         )
 
-    decrease_num_active_chats(participant.actor_id)
+    if update_budget:
+        decrease_num_active_chats(participant.actor_id)
     channel_id_to_close = participant.channel_id
     guild_id = actors.get_guild_for_actor(participant.actor_id).id
 
@@ -1115,13 +1181,15 @@ async def close_chat_session(participant: ChatParticipant):
     )
     participant.chat_hub_msg_id = str(chat_hub_message.id)
 
-    # 'participant' is the chat -> actor, channel ID, msg ID mapping
-    store_participant(participant.chat_name, participant)
-
     if should_log:
         # Add chat log entry for this event
         entry = ChatLogEntry(None, closed_handle_id=participant.handle)
-        write_new_chat_log_entry(participant.chat_name, entry)
+        participant.closed_log_index = write_new_chat_log_entry(
+            participant.chat_name, entry
+        )
+
+    # 'participant' is the chat -> actor, channel ID, msg ID mapping
+    store_participant(participant.chat_name, participant)
 
 
 ### Archiving chats -- currently only happens when burning burner handles
@@ -1349,17 +1417,9 @@ async def process_message_data(
     poster_id = poster_id if full_post else None
     post = posting.create_post(msg_data, poster_id, attachments_supported=False)
     entry = ChatLogEntry(post, full_post)
-    get_chat_state(chat_name)
     write_new_chat_log_entry(chat_name, entry)
 
 
-async def repost_string_buffer(channel, string_buffer: str):
-    if string_buffer != "":
-        await channel.send(string_buffer)
-        string_buffer = ""
-    return string_buffer
-
-
 def get_archived_alert(handle_id: str):
     return f"```Cannot connect to any of the recipients from {handle_id}. This chat is archived in read-only form.```"
 
@@ -1376,49 +1436,101 @@ def get_reopened_chat_alert(chat_name: str):
     return f"```====== re-opened chat {chat_name} ======```"
 
 
-async def repost_message_history(channel, chat_state, participant: ChatParticipant):
-    any_history = False
-    index_to_remove: int = -1
-    # each entry is a ChatLogEntry
-    string_buffer = ""
-    for index, entry in get_chat_log_iterable(chat_state, participant.chat_name):
-        if (
-            entry.closed_handle_id is not None
-            and entry.closed_handle_id == participant.handle
-            and any_history
-        ):
-            # This entry denotes the point where closed_handle_id stopped listening
-            # and there has been history before this point.
-            # Empty the current buffer:
-            string_buffer = await repost_string_buffer(channel, string_buffer)
-            # Print delimiter:
-            await channel.send(get_last_session_closed_alert())
-            # We don't need to remember every time someone has closed a chat, just the last one:
-            index_to_remove = index
+# When a session is (re)opened, only the last part of the history is posted.
+# Anything older can be paged through with the buttons of ChatHistoryView.
+history_replay_entries = 30
+max_message_length = 2000
+
+
+def pack_into_messages(pieces: list[str]):
+    # Joins the pieces line by line into as few messages as possible
+    messages: list[str] = []
+    current = ""
+    for piece in pieces:
+        while len(piece) > max_message_length:
+            if current != "":
+                messages.append(current)
+                current = ""
+            messages.append(piece[:max_message_length])
+            piece = piece[max_message_length:]
+        if current == "":
+            current = piece
+        elif len(current) + 1 + len(piece) <= max_message_length:
+            current += f"\n{piece}"
+        else:
+            messages.append(current)
+            current = piece
+    if current != "":
+        messages.append(current)
+    return messages
+
+
+def get_history_end(participant: ChatParticipant):
+    # Archived participants must not see anything after they lost the connection
+    if is_archived(participant):
+        for index, entry in get_chat_log_iterable(participant.chat_name):
+            if entry.archived_handle_id == participant.handle:
+                return index
+    return len(get_chat_log(participant.chat_name))
+
+
+def find_closed_log_indexes(participant: ChatParticipant):
+    return [
+        index
+        for index, entry in get_chat_log_iterable(participant.chat_name)
+        if entry.closed_handle_id == participant.handle
+    ]
+
+
+def render_chat_history(
+    participant: ChatParticipant, start: int, stop: int, any_history: bool
+):
+    # Returns the entries from start up to stop as messages,
+    # and whether there were any messages among them
+    pieces = []
+    for _, string in get_chat_log(participant.chat_name).entries(start, stop):
+        entry = ChatLogEntry.from_string(string)
+        if entry.closed_handle_id is not None:
+            if entry.closed_handle_id == participant.handle and any_history:
+                # This entry denotes the point where closed_handle_id stopped listening
+                # and there has been history before this point.
+                pieces.append(get_last_session_closed_alert())
         elif entry.archived_handle_id is not None:
             if entry.archived_handle_id != participant.handle and any_history:
                 # This entry denotes the point where connection was lost to another participant
-                # Empty the current buffer:
-                string_buffer = await repost_string_buffer(channel, string_buffer)
-                # Print delimiter:
-                await channel.send(
-                    get_other_unreachable_alert(entry.archived_handle_id)
-                )
-            elif entry.archived_handle_id == participant.handle:
-                # This denotes the point where connection was lost to us
-                # We shall not read any histoy past this point
-                break
+                pieces.append(get_other_unreachable_alert(entry.archived_handle_id))
         elif entry.message is not None:
             any_history = True
-            if entry.header:
-                # Send the buffer we have built up so far
-                string_buffer = await repost_string_buffer(channel, string_buffer)
-            if string_buffer == "":
-                string_buffer = entry.message
-            else:
-                string_buffer += f"\n{entry.message}"
-    # Finish by sending anything that is left over
-    await repost_string_buffer(channel, string_buffer)
+            pieces.append(entry.message)
+    return (pack_into_messages(pieces), any_history)
+
+
+def load_chat_history_page(participant: ChatParticipant, stop: int):
+    # Walks backwards from stop until it finds something to show
+    while stop > 0:
+        start = max(0, stop - history_replay_entries)
+        (messages, _) = render_chat_history(participant, start, stop, start > 0)
+        if messages or start == 0:
+            return (start, messages)
+        stop = start
+    return (0, [])
+
+
+async def repost_message_history(channel, chat_state, participant: ChatParticipant):
+    stop = get_history_end(participant)
+    start = max(0, stop - history_replay_entries)
+    (messages, any_history) = render_chat_history(participant, start, stop, start > 0)
+
+    if start > 0:
+        view = ChatHistoryView(
+            lambda before: load_chat_history_page(participant, before), start
+        )
+        view.message = await channel.send(
+            "```====== earlier history ======```", view=view
+        )
+    for message in messages:
+        await channel.send(message)
+
     if participant.session_status in [
         session_status_open_archive,
         session_status_closed_archive,
@@ -1428,7 +1540,10 @@ async def repost_message_history(channel, chat_state, participant: ChatParticipa
         await channel.send(get_reopened_chat_alert(participant.channel_name))
 
     # Remove the entry that denoted last time session was closed
-    # TODO: chat_log_length_at_last_close could also be tracked on a participant level
-    # would probably be cleaner
-    if index_to_remove != -1:
-        remove_entry_from_chat_log(participant.chat_name, index_to_remove)
+    if participant.closed_log_index is not None:
+        remove_entry_from_chat_log(participant.chat_name, participant.closed_log_index)
+        participant.closed_log_index = None
+    else:
+        # Participants stored before the index was kept have to look for theirs
+        for index in find_closed_log_indexes(participant):
+            remove_entry_from_chat_log(participant.chat_name, index)
@@ -6,7 +6,7 @@ def get_all_conf_files():
         os.path.join(dp, f)
         for dp, dn, filenames in os.walk(".")
         for f in filenames
-        if os.path.splitext(f)[1] == ".conf"
+        if os.path.splitext(f)[1] in [".conf", ".jsonl", ".idx"]
     ]
 
 
@@ -10,8 +10,8 @@ class Handle(Base):
     __tablename__ = "handle"
 
     id: Mapped[int] = mapped_column(init=False, primary_key=True)
-    name: Mapped[str]
-    balance: Mapped[int]
+    name: Mapped[str] = mapped_column(unique=True)
+    balance: Mapped[int] = mapped_column(default=0)
     outgoing_tansfers: Mapped[list["Transaction"]] = relationship(
         init=False,
         back_populates="sender",
@@ -28,8 +28,12 @@ class Transaction(Base):
     __tablename__ = "transaction"
 
     id: Mapped[int] = mapped_column(init=False, primary_key=True)
-    sender_id: Mapped[int | None] = mapped_column(ForeignKey("handle.id"), init=False)
-    receiver_id: Mapped[int | None] = mapped_column(ForeignKey("handle.id"), init=False)
+    sender_id: Mapped[int | None] = mapped_column(
+        ForeignKey("handle.id"), init=False, index=True
+    )
+    receiver_id: Mapped[int | None] = mapped_column(
+        ForeignKey("handle.id"), init=False, index=True
+    )
     amount: Mapped[int]
     operation: Mapped[str]
     data: Mapped[str | None] = mapped_column(init=False)
@@ -69,3 +73,17 @@ class Artifact(Base):
     )
     password: Mapped[str | None] = mapped_column(default=None)
     announcement: Mapped[str | None] = mapped_column(default=None)
+
+
+class ShopOrder(Base):
+    __tablename__ = "shop_order"
+    __table_args__ = (UniqueConstraint("shop_id", "status", "key"),)
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True)
+    shop_id: Mapped[str] = mapped_column(index=True)
+    # OrderStatus of the order, which decides what the key is:
+    # the delivery ID for active orders, the order ID for locked ones
+    status: Mapped[str]
+    key: Mapped[str]
+    msg_id: Mapped[str | None]
+    data: Mapped[str]
@@ -0,0 +1,49 @@
+from collections.abc import Sequence
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import ShopOrder
+
+# The open orders of the shops. The bot keeps them in memory and writes every
+# change through to this table, which is only read back at startup.
+
+
+async def load_all(session: AsyncSession) -> Sequence[ShopOrder]:
+    res = await session.scalars(select(ShopOrder))
+    return res.all()
+
+
+async def save(
+    session: AsyncSession,
+    shop_id: str,
+    status: str,
+    key: str,
+    msg_id: str | None,
+    data: str,
+):
+    await session.execute(
+        delete(ShopOrder)
+        .where(ShopOrder.shop_id == shop_id)
+        .where(ShopOrder.status == status)
+        .where(ShopOrder.key == key)
+    )
+    session.add(
+        ShopOrder(shop_id=shop_id, status=status, key=key, msg_id=msg_id, data=data)
+    )
+    await session.commit()
+
+
+async def remove(session: AsyncSession, shop_id: str, status: str, key: str):
+    await session.execute(
+        delete(ShopOrder)
+        .where(ShopOrder.shop_id == shop_id)
+        .where(ShopOrder.status == status)
+        .where(ShopOrder.key == key)
+    )
+    await session.commit()
+
+
+async def clear(session: AsyncSession, shop_id: str):
+    await session.execute(delete(ShopOrder).where(ShopOrder.shop_id == shop_id))
+    await session.commit()
@@ -1,66 +1,227 @@
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from collections.abc import Iterable
+from typing import cast
 
-from talesbot import finances
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
 from ..custom_types import TransTypes
-from ..errors import InsufficientBalanceError, InvalidAmountError, InvalidPartiesError
+from ..errors import (
+    AccountNotFoundError,
+    InsufficientBalanceError,
+    InvalidAmountError,
+    InvalidPartiesError,
+)
 from .models import Handle, Transaction
 
+# The ledger: balances live in the handle table and every movement of money
+# is a row in the transaction table. A handle with sender or receiver None
+# means money was created or removed by the system.
 
-def _get_handle(session: Session, handle_name: str | None) -> Handle | None:
-    if handle_name is None:
-        return None
 
-    handle = session.scalar(select(Handle).where(Handle.name == handle_name))
-    if handle is None:
-        balance = finances.get_current_balance_handle_id(handle_name)
-        handle = Handle(name=handle_name, balance=balance)
-        session.add(handle)
-        session.commit()
-
-    return handle
+async def get_balance(session: AsyncSession, handle_name: str) -> int:
+    balance = await session.scalar(
+        select(Handle.balance).where(Handle.name == handle_name)
+    )
+    if balance is None:
+        raise AccountNotFoundError(handle_name)
+    return balance
+
+
+async def get_balances(
+    session: AsyncSession, handle_names: Iterable[str] | None = None
+) -> dict[str, int]:
+    # Balances of the given accounts, or of all accounts
+    stmt = select(Handle.name, Handle.balance)
+    if handle_names is not None:
+        stmt = stmt.where(Handle.name.in_(handle_names))
+    res = await session.execute(stmt)
+    return {name: balance for (name, balance) in res.all()}
+
+
+async def open_accounts(
+    session: AsyncSession, balances: dict[str, int]
+) -> dict[str, int]:
+    # Creates the accounts that do not exist yet, with the given opening balances.
+    # Returns the row id of every requested account.
+    res = await session.execute(
+        select(Handle.name, Handle.id).where(Handle.name.in_(balances))
+    )
+    ids = {name: id for (name, id) in res.all()}
+    missing = [
+        {"name": name, "balance": balance}
+        for (name, balance) in balances.items()
+        if name not in ids
+    ]
+    if missing:
+        res = await session.execute(
+            insert(Handle).returning(Handle.name, Handle.id), missing
+        )
+        ids.update({name: id for (name, id) in res.all()})
+    await session.commit()
+    return ids
+
+
+async def open_account(session: AsyncSession, handle_name: str, reset: bool = True):
+    await open_accounts(session, {handle_name: 0})
+    if reset:
+        await set_balance(session, handle_name, 0)
+
+
+async def lock_accounts(
+    session: AsyncSession, handle_names: Iterable[str | None]
+) -> dict[str, tuple[int, int]]:
+    # Locks the rows of the given accounts until the end of the transaction
+    # and returns (id, balance) for each of them that exists. Rows are always
+    # locked in id order, so two transactions touching the same accounts never
+    # wait on each other in a cycle. Backends without row locks (SQLite) ignore
+    # FOR UPDATE; the conditional UPDATE in apply_transfer() still guarantees
+    # that nobody overdraws.
+    names = [name for name in handle_names if name is not None]
+    res = await session.execute(
+        select(Handle.name, Handle.id, Handle.balance)
+        .where(Handle.name.in_(names))
+        .order_by(Handle.id)
+        .with_for_update()
+    )
+    return {name: (id, balance) for (name, id, balance) in res.all()}
+
+
+async def set_balance(session: AsyncSession, handle_name: str, balance: int) -> int:
+    # Overwrites the balance, recording the old balance as removed by the system
+    # and the new one as created by the system. Returns the old balance.
+    accounts = await lock_accounts(session, [handle_name])
+    if handle_name not in accounts:
+        await session.rollback()
+        raise AccountNotFoundError(handle_name)
+    (handle_id, old_balance) = accounts[handle_name]
+    if old_balance == balance:
+        await session.rollback()
+        return old_balance
+
+    await session.execute(
+        update(Handle).where(Handle.id == handle_id).values(balance=balance),
+        execution_options={"synchronize_session": False},
+    )
+    history = []
+    if old_balance > 0:
+        history.append({"sender_id": handle_id, "amount": old_balance})
+    if balance > 0:
+        history.append({"receiver_id": handle_id, "amount": balance})
+    for entry in history:
+        await session.execute(
+            insert(Transaction).values(operation=TransTypes.Transfer.value, **entry)
+        )
+    await session.commit()
+    return old_balance
 
 
-def transfer(
-    session: Session,
+async def apply_transfer(
+    session: AsyncSession,
     sender_handle: str | None,
     receiver_handle: str | None,
     amount: int,
     allow_partial: bool = False,
-    operation=TransTypes.Transfer,
-):
+    operation: TransTypes = TransTypes.Transfer,
+    data: str | None = None,
+    emoji: str | None = None,
+) -> int:
+    # Does the work of transfer() inside the current transaction without
+    # committing it. A transfer that raises has not written anything, so the
+    # caller can carry on with the same transaction.
     if sender_handle == receiver_handle:
         raise InvalidPartiesError(sender_handle, receiver_handle)
 
     if amount <= 0:
         raise InvalidAmountError(amount)
 
-    sender = _get_handle(session, sender_handle)
-    receiver = _get_handle(session, receiver_handle)
-
-    sender_balance = sender.balance if sender is not None else amount
+    accounts = await lock_accounts(session, [sender_handle, receiver_handle])
+    for handle_name in (sender_handle, receiver_handle):
+        if handle_name is not None and handle_name not in accounts:
+            raise AccountNotFoundError(handle_name)
+    (sender_id, sender_balance) = accounts.get(sender_handle, (None, amount))
+    (receiver_id, _) = accounts.get(receiver_handle, (None, 0))
 
     if allow_partial:
         amount = min(amount, sender_balance)
+        if amount <= 0:
+            return 0
 
     if sender_balance < amount:
         raise InsufficientBalanceError(
             sender_handle, receiver_handle, amount, sender_balance
         )
 
-    if receiver is not None:
-        receiver.balance += amount
-
-    if sender is not None:
-        sender.balance -= amount
+    # Updates both accounts, but only if the sender still has the money
+    stmt = update(Handle).where(Handle.id.in_([id for (id, _) in accounts.values()]))
+    if sender_id is not None:
+        sender = aliased(Handle)
+        stmt = stmt.where(
+            select(sender.balance).where(sender.id == sender_id).scalar_subquery()
+            >= amount
+        )
+    res = await session.execute(
+        stmt.values(
+            balance=Handle.balance
+            + case((Handle.id == sender_id, -amount), else_=amount)
+        ).returning(Handle.id),
+        execution_options={"synchronize_session": False},
+    )
+    if len(res.all()) != len(accounts):
+        sender_balance = await get_balance(session, cast(str, sender_handle))
+        raise InsufficientBalanceError(
+            sender_handle, receiver_handle, amount, sender_balance
+        )
 
-    transaction = Transaction(
-        sender=sender,
-        receiver=receiver,
-        amount=amount,
-        operation=operation,
+    await session.execute(
+        insert(Transaction).values(
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            amount=amount,
+            operation=TransTypes(operation).value,
+            data=data,
+            emoji=emoji,
+        )
     )
+    return amount
+
 
-    session.add(transaction)
-    session.commit()
+async def transfer(
+    session: AsyncSession,
+    sender_handle: str | None,
+    receiver_handle: str | None,
+    amount: int,
+    allow_partial: bool = False,
+    operation: TransTypes = TransTypes.Transfer,
+    data: str | None = None,
+    emoji: str | None = None,
+) -> int:
+    # Moves money between two accounts (or to/from the system) and records it.
+    # Returns the amount actually transferred, which is only ever less than
+    # the requested amount if allow_partial is set.
+    # The balance check and the debit happen in one transaction on locked rows,
+    # so concurrent transfers from the same account cannot both pass the check.
+    try:
+        amount = await apply_transfer(
+            session,
+            sender_handle,
+            receiver_handle,
+            amount,
+            allow_partial=allow_partial,
+            operation=operation,
+            data=data,
+            emoji=emoji,
+        )
+    except BaseException:
+        await session.rollback()
+        raise
+    await session.commit()
+    return amount
+
+
+async def import_history(session: AsyncSession, entries: list[dict]):
+    # Bulk insert of already settled transactions, used when migrating
+    # from the old finances files. Balances are not touched.
+    if entries:
+        await session.execute(insert(Transaction), entries)
+        await session.commit()
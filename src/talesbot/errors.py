@@ -64,6 +64,12 @@ class InvalidAmountError(ReportError):
         super().__init__(message)
 
 
+class AccountNotFoundError(ReportError):
+    def __init__(self, handle: str) -> None:
+        self.handle = handle
+        super().__init__(f"Handle {handle} does not have an account")
+
+
 class ArtifactNotFoundError(ReportError):
     def __init__(self, name: str) -> None:
         super().__init__(f'Entity "{name}" not found. Check the spelling')
@@ -1,3 +1,7 @@
+import logging
+import os
+from collections.abc import Iterable
+from contextlib import contextmanager
 from copy import deepcopy
 
 import simplejson
@@ -7,7 +11,7 @@ from discord.ext import commands
 
 from talesbot import checks
 
-from .errors import InsufficientBalanceError, InvalidAmountError, InvalidPartiesError
+from .errors import InsufficientBalanceError, ReportError
 
 from .utils import fmt_handle, fmt_money
 
@@ -15,9 +19,14 @@ from . import actors, handles, players
 from .common import coin, transaction_collected, transaction_collector
 from .config import config_dir
 from .custom_types import Handle, HandleTypes, PostTimestamp, Transaction, TransTypes
+from .database import SessionM
+from .database import transaction as ledger
 
 ### Module finances.py
 # This module tracks and handles money and transactions between handles
+# Balances and history are kept in the database, see database/transaction.py
+
+logger = logging.getLogger(__name__)
 
 
 class FinancesCog(commands.Cog, name="finances"):
@@ -104,7 +113,7 @@ class FinancesCog(commands.Cog, name="finances"):
     )
     async def show_balance_command(self, interaction: Interaction):
         player_id = players.get_player_id(str(interaction.user.id))
-        response = get_all_handles_balance_report(player_id)
+        response = await get_all_handles_balance_report(player_id)
         await interaction.response.send_message(response, ephemeral=True)
 
     @app_commands.command(
@@ -128,6 +137,8 @@ async def setup(bot):
     await bot.add_cog(FinancesCog(bot))
 
 
+# Format of the history entries in the old finances/*.conf files,
+# still needed to migrate them into the database
 class InternalTransRecord:
     def __init__(
         self,
@@ -152,9 +163,8 @@ class InternalTransRecord:
         obj = InternalTransRecord(None, None, 0)
         loaded_dict = simplejson.loads(string)
         obj.__dict__.update(loaded_dict)
-        obj.timestamp: PostTimestamp = PostTimestamp.from_string(
-            loaded_dict["timestamp"]
-        )
+        if loaded_dict["timestamp"] is not None:
+            obj.timestamp = PostTimestamp.from_string(loaded_dict["timestamp"])
         return obj
 
     def to_string(self):
@@ -190,58 +200,166 @@ highest_transaction_index = "___highest"
 
 system_fake_handle = "[system]"
 
+# Balances are cached in memory once they have been read from the database.
+# Every change to the ledger goes through changing_balances(), which drops the
+# affected entries. ledger_version counts the changes, so that a read racing
+# with a write never caches a stale balance. It also serves as ETag for the API.
+balance_cache: dict[str, int] = {}
+all_balances_cached = False
+ledger_version = 0
+
+
+def invalidate_balances(handle_ids: Iterable[str | None] | None = None):
+    # Without handle IDs the whole cache is dropped
+    global all_balances_cached, ledger_version
+    ledger_version += 1
+    all_balances_cached = False
+    if handle_ids is None:
+        balance_cache.clear()
+    else:
+        for handle_id in handle_ids:
+            balance_cache.pop(handle_id, None)
+
+
+@contextmanager
+def changing_balances(*handle_ids: str | None):
+    invalidate_balances(handle_ids)
+    try:
+        yield
+    finally:
+        invalidate_balances(handle_ids)
+
+
+async def init_finances():
+    # The .conf files are migrated before this, by migrate_finances_confs()
+    async with SessionM() as session:
+        await ledger.open_accounts(
+            session,
+            {
+                handle.handle_id: 0
+                for handle in handles.get_all_handles()
+                if can_have_finances(handle.handle_type)
+            },
+        )
+    invalidate_balances()
+
+
+async def migrate_finances_confs():
+    # One-shot import of balances and history from the per-handle .conf files
+    # that were used before the ledger moved into the database.
+    # Imported files are renamed so that they are never read again.
+    # Must run before anything opens ledger accounts: open_accounts leaves existing
+    # accounts alone, so an account opened earlier would keep a balance of 0.
+    folder = config_dir / finances_conf_dir
+    file_names = [f for f in os.listdir(folder) if f.endswith(".conf")]
+    if not file_names:
+        return
 
-def init_finances():
-    for handle in handles.get_all_handles():
-        if can_have_finances(handle.handle_type):
-            init_finances_for_handle(handle, overwrite=False)
+    balances: dict[str, int] = {}
+    records: list[tuple[str, InternalTransRecord]] = []
+    for file_name in file_names:
+        handle_id = file_name.removesuffix(".conf")
+        finances_conf = ConfigObj(str(folder / file_name))
+        if balance_index not in finances_conf:
+            continue
+        balances[handle_id] = int(finances_conf[balance_index])
+        for index, entry in finances_conf.get(transactions_index, {}).items():
+            if index != highest_transaction_index:
+                records.append((handle_id, InternalTransRecord.from_string(entry)))
+
+    async with SessionM() as session:
+        ids = await ledger.open_accounts(session, balances)
+        history = []
+        for handle_id, record in records:
+            # Transfers between two players were stored once for each of them,
+            # only keep the copy of the receiving side.
+            if record.amount < 0 and record.other_actor is not None:
+                continue
+            if record.amount > 0:
+                (sender, receiver) = (record.other_handle, handle_id)
+            else:
+                (sender, receiver) = (handle_id, record.other_handle)
+            history.append(
+                {
+                    "sender_id": ids.get(sender),
+                    "receiver_id": ids.get(receiver),
+                    "amount": abs(record.amount),
+                    "operation": TransTypes(record.cause).value,
+                    "data": record.data,
+                    "emoji": record.emoji,
+                }
+            )
+        await ledger.import_history(session, history)
+
+    for file_name in file_names:
+        os.replace(folder / file_name, folder / f"{file_name}.migrated")
+    logger.info(
+        f"Migrated {len(balances)} accounts and {len(history)} transactions "
+        "from the finances files"
+    )
 
 
-def init_finances_for_handle(handle: Handle, overwrite: bool = True):
-    file_name = str(config_dir / finances_conf_dir / f"{handle.handle_id}.conf")
-    finances_conf = ConfigObj(file_name)
-    if overwrite:
-        for entry in finances_conf:
-            del finances_conf[entry]
-    if balance_index not in finances_conf:
-        finances_conf[balance_index] = "0"
-    if transactions_index not in finances_conf:
-        finances_conf[transactions_index] = {}
-    if highest_transaction_index not in finances_conf[transactions_index]:
-        finances_conf[transactions_index][highest_transaction_index] = "0"
-    finances_conf.write()
+async def init_finances_for_handle(handle: Handle, overwrite: bool = True):
+    with changing_balances(handle.handle_id):
+        async with SessionM() as session:
+            await ledger.open_account(session, handle.handle_id, reset=overwrite)
 
 
 async def deinit_finances_for_handle(handle: Handle, record: bool):
-    file_name = str(config_dir / finances_conf_dir / f"{handle.handle_id}.conf")
-    finances_conf = ConfigObj(file_name)
-    if finances_conf:
-        for entry in finances_conf:
-            del finances_conf[entry]
-        finances_conf.write()
+    # The account itself is kept so that its history stays intact
+    with changing_balances(handle.handle_id):
+        async with SessionM() as session:
+            await ledger.open_account(session, handle.handle_id, reset=False)
+            await ledger.set_balance(session, handle.handle_id, 0)
     if record:
         await actors.refresh_financial_statement(handle.actor_id)
 
 
-def get_current_balance(handle: Handle):
-    return get_current_balance_handle_id(handle.handle_id)
-
-
-def get_current_balance_handle_id(handle_id: str):
-    file_name = str(config_dir / finances_conf_dir / f"{handle_id}.conf")
-    finances_conf = ConfigObj(file_name)
-    return int(finances_conf[balance_index])
+async def get_current_balance(handle: Handle):
+    return await get_current_balance_handle_id(handle.handle_id)
+
+
+async def get_current_balance_handle_id(handle_id: str):
+    if handle_id in balance_cache:
+        return balance_cache[handle_id]
+    version = ledger_version
+    async with SessionM() as session:
+        balance = await ledger.get_balance(session, handle_id)
+    if version == ledger_version:
+        balance_cache[handle_id] = balance
+    return balance
+
+
+async def get_balances(handle_ids: Iterable[str] | None = None) -> dict[str, int]:
+    # All balances, or only those of the given handles
+    global all_balances_cached
+    if not all_balances_cached:
+        version = ledger_version
+        async with SessionM() as session:
+            balances = await ledger.get_balances(session)
+        if version == ledger_version:
+            balance_cache.clear()
+            balance_cache.update(balances)
+            all_balances_cached = True
+    else:
+        balances = balance_cache
+    if handle_ids is None:
+        return dict(balances)
+    return {
+        handle_id: balances[handle_id]
+        for handle_id in handle_ids
+        if handle_id in balances
+    }
 
 
-def set_current_balance(handle: Handle, balance: int):
-    set_current_balance_handle_id(handle.handle_id, balance)
+async def set_current_balance(handle: Handle, balance: int):
+    return await set_current_balance_handle_id(handle.handle_id, balance)
 
 
-def set_current_balance_handle_id(handle_id: str, balance: int):
-    file_name = str(config_dir / finances_conf_dir / f"{handle_id}.conf")
-    finances_conf = ConfigObj(file_name)
-    finances_conf[balance_index] = str(balance)
-    finances_conf.write()
+async def set_current_balance_handle_id(handle_id: str, balance: int):
+    with changing_balances(handle_id):
+        async with SessionM() as session:
+            return await ledger.set_balance(session, handle_id, balance)
 
 
 async def transfer_funds(
@@ -251,33 +369,80 @@ async def transfer_funds(
     allow_partial=False,
     operation=TransTypes.Transfer,
 ):
-    if sender_handle == receiver_handle:
-        raise InvalidPartiesError(sender_handle, receiver_handle)
-
-    if amount <= 0:
-        raise InvalidAmountError(amount)
-
-    sender_balance = (
-        get_current_balance_handle_id(sender_handle)
-        if sender_handle is not None
-        else amount
-    )
+    with changing_balances(sender_handle, receiver_handle):
+        async with SessionM() as session:
+            amount = await ledger.transfer(
+                session,
+                sender_handle,
+                receiver_handle,
+                amount,
+                allow_partial=allow_partial,
+                operation=operation,
+            )
 
-    if allow_partial:
-        amount = min(amount, sender_balance)
+    return await report_transfer(sender_handle, receiver_handle, amount, operation)
 
-    if sender_balance < amount:
-        raise InsufficientBalanceError(
-            sender_handle, receiver_handle, amount, sender_balance
-        )
 
-    if receiver_handle is not None:
-        receiver_balance = get_current_balance_handle_id(receiver_handle)
-        set_current_balance_handle_id(receiver_handle, receiver_balance + amount)
+async def transfer_funds_batch(
+    transfers: list[tuple[str | None, str | None, int, bool]],
+    atomic: bool = False,
+    operation=TransTypes.Transfer,
+):
+    # Applies (sender, receiver, amount, allow_partial) transfers in a single
+    # database transaction. Returns a Transaction for every transfer that went
+    # through and the error for every one that did not.
+    # If atomic is set, one failed transfer means that none of them are applied.
+    parties = {handle for (s, r, _, _) in transfers for handle in (s, r)}
+    with changing_balances(*parties):
+        async with SessionM() as session:
+            # Lock everything up front so that the lock order stays deterministic
+            await ledger.lock_accounts(session, parties)
+            amounts: list[int | ReportError] = []
+            for sender_handle, receiver_handle, amount, allow_partial in transfers:
+                try:
+                    amounts.append(
+                        await ledger.apply_transfer(
+                            session,
+                            sender_handle,
+                            receiver_handle,
+                            amount,
+                            allow_partial=allow_partial,
+                            operation=operation,
+                        )
+                    )
+                except ReportError as e:
+                    amounts.append(e)
+                    if atomic:
+                        break
+            if atomic and amounts and isinstance(amounts[-1], ReportError):
+                await session.rollback()
+                # Only the last attempted transfer failed, the rest were rolled back
+                not_applied = ReportError(
+                    "Not applied, another transfer in the batch failed"
+                )
+                failed_at = len(amounts) - 1
+                return [
+                    amounts[i] if i == failed_at else not_applied
+                    for i in range(len(transfers))
+                ]
+            await session.commit()
+
+    results: list[Transaction | ReportError] = []
+    for (sender_handle, receiver_handle, _, _), amount in zip(
+        transfers, amounts, strict=True
+    ):
+        if isinstance(amount, ReportError):
+            results.append(amount)
+        else:
+            results.append(
+                await report_transfer(sender_handle, receiver_handle, amount, operation)
+            )
+    return results
 
-    if sender_handle is not None:
-        set_current_balance_handle_id(sender_handle, sender_balance - amount)
 
+async def report_transfer(
+    sender_handle: str | None, receiver_handle: str | None, amount: int, operation
+):
     transaction = Transaction(
         payer=fmt_handle(sender_handle),
         payer_actor=None,
@@ -285,6 +450,7 @@ async def transfer_funds(
         recip_actor=None,
         amount=amount,
         cause=operation,
+        success=True,
     )
 
     find_transaction_parties(transaction)
@@ -309,19 +475,8 @@ async def transfer_funds(
     return transaction
 
 
-def add_internal_record(handle_id: str, record: InternalTransRecord):
-    file_name = str(config_dir / finances_conf_dir / f"{handle_id}.conf")
-    finances_conf = ConfigObj(file_name)
-    prev_highest = int(finances_conf[transactions_index][highest_transaction_index])
-    new_index = str(prev_highest + 1)
-    finances_conf[transactions_index][highest_transaction_index] = new_index
-    finances_conf[transactions_index][new_index] = record.to_string()
-    finances_conf.write()
-
-
 async def overwrite_balance(handle: Handle, balance: int):
-    old_balance = get_current_balance(handle)
-    set_current_balance(handle, balance)
+    old_balance = await set_current_balance(handle, balance)
     transaction = Transaction(
         payer=handle.handle_id,
         payer_actor=None,
@@ -351,16 +506,24 @@ def can_have_finances(handle_type: HandleTypes):
     return Handle.is_active_handle_type(handle_type)
 
 
-def get_all_handles_balance_report(actor_id: str):
+async def get_all_handles_balance_report(actor_id: str):
     report = ""
 
     current_handle: Handle = handles.get_active_handle(actor_id)
+    npc_handles = list(
+        handles.get_handles_for_actor_of_types(actor_id, [HandleTypes.NPC])
+    )
+    own_handles = list(handles.get_handles_for_actor(actor_id, include_npc=False))
+    balances = await get_balances(
+        [handle.handle_id for handle in npc_handles + own_handles]
+    )
+
     any_npc_found = False
-    for handle in handles.get_handles_for_actor_of_types(actor_id, [HandleTypes.NPC]):
+    for handle in npc_handles:
         if not any_npc_found:
             any_npc_found = True
             report += "[OFF: Current balance for NPC accounts you control:]\n"
-        balance = get_current_balance(handle)
+        balance = balances.get(handle.handle_id, 0)
         if handle.handle_id == current_handle.handle_id:
             report = report + f"> [**{handle.handle_id}**: {coin} **{balance}**]\n"
         else:
@@ -368,8 +531,8 @@ def get_all_handles_balance_report(actor_id: str):
 
     report += "Current balance for all your accounts:\n"
     total = 0
-    for handle in handles.get_handles_for_actor(actor_id, include_npc=False):
-        balance = get_current_balance(handle)
+    for handle in own_handles:
+        balance = balances.get(handle.handle_id, 0)
         total += balance
         balance_str = str(balance)
         if handle.handle_id == current_handle.handle_id:
@@ -383,20 +546,22 @@ def get_all_handles_balance_report(actor_id: str):
     return report
 
 
-def transfer_funds_if_available(transaction: Transaction):
-    avail_at_payer = get_current_balance_handle_id(transaction.payer)
-    if avail_at_payer >= transaction.amount:
-        amount_at_recip = get_current_balance_handle_id(transaction.recip)
-        set_current_balance_handle_id(
-            transaction.recip, amount_at_recip + transaction.amount
-        )
-        set_current_balance_handle_id(
-            transaction.payer, avail_at_payer - transaction.amount
-        )
+async def transfer_funds_if_available(transaction: Transaction):
+    try:
+        with changing_balances(transaction.payer, transaction.recip):
+            async with SessionM() as session:
+                await ledger.transfer(
+                    session,
+                    transaction.payer,
+                    transaction.recip,
+                    transaction.amount,
+                    operation=transaction.cause,
+                    data=transaction.data,
+                    emoji=transaction.emoji,
+                )
         transaction.success = True
-    else:
+    except InsufficientBalanceError:
         transaction.success = False
-    # return transaction
 
 
 async def transfer_from_burner(burner: Handle, new_active: Handle, amount: int):
@@ -409,16 +574,16 @@ async def transfer_from_burner(burner: Handle, new_active: Handle, amount: int):
         amount=amount,
     )
     find_transaction_parties(transaction)
-    transfer_funds_if_available(transaction)
+    await transfer_funds_if_available(transaction)
     await record_transaction(transaction)
 
 
 async def add_funds(handle: Handle, amount: int):
     if amount == 0:
         return
-    previous_balance = get_current_balance(handle)
-    new_balance = previous_balance + amount
-    set_current_balance_handle_id(handle.handle_id, new_balance)
+    with changing_balances(handle.handle_id):
+        async with SessionM() as session:
+            await ledger.transfer(session, None, handle.handle_id, amount)
     transaction = Transaction(
         payer=system_fake_handle,
         payer_actor=None,
@@ -444,23 +609,30 @@ async def collect_all_funds(actor_id: str):
         success=True,
         cause=TransTypes.Collect,
     )
-    balance_on_current = 0
-    for handle in handles.get_handles_for_actor(actor_id, include_npc=False):
-        collected = get_current_balance(handle)
-        if collected > 0:
-            total += collected
-            set_current_balance(handle, 0)
-            if handle.handle_id == current_handle.handle_id:
-                balance_on_current = collected
-            else:
-                transaction.amount = collected
-                transaction.payer = handle.handle_id
-                transaction.last_in_sequence = False
-                await record_transaction(transaction)
-    set_current_balance(current_handle, total)
+    own_handles = list(handles.get_handles_for_actor(actor_id, include_npc=False))
+    with changing_balances(*[handle.handle_id for handle in own_handles]):
+        async with SessionM() as session:
+            for handle in own_handles:
+                if handle.handle_id == current_handle.handle_id:
+                    continue
+                collected = await ledger.get_balance(session, handle.handle_id)
+                if collected > 0:
+                    collected = await ledger.transfer(
+                        session,
+                        handle.handle_id,
+                        current_handle.handle_id,
+                        collected,
+                        allow_partial=True,
+                        operation=TransTypes.Collect,
+                    )
+                    total += collected
+                    transaction.amount = collected
+                    transaction.payer = handle.handle_id
+                    transaction.last_in_sequence = False
+                    await record_transaction(transaction)
     transaction.payer_actor = None
     transaction.recip_actor = actor_id
-    transaction.amount = total - balance_on_current
+    transaction.amount = total
     transaction.payer = transaction_collected
     transaction.recip = current_handle.handle_id
     transaction.last_in_sequence = True
@@ -554,9 +726,9 @@ async def try_to_pay(transaction: Transaction, from_reaction: bool = False):
         transaction.recip_actor = recip_actor
         transaction.amount = -transaction.amount
 
-    transfer_funds_if_available(transaction)
+    await transfer_funds_if_available(transaction)
     if not transaction.success:
-        avail = get_current_balance_handle_id(transaction.payer)
+        avail = await get_current_balance_handle_id(transaction.payer)
         if from_reaction:
             transaction.report = f"Tried to transfer {coin} **{transaction.amount}** from {transaction.payer} to {transaction.recip} based on your reaction (emoji), but your balance is {avail}."
         else:
@@ -580,7 +752,6 @@ async def try_to_pay(transaction: Transaction, from_reaction: bool = False):
 
 
 async def record_transaction(transaction: Transaction):
-    record_transaction_internal(transaction)
     if int(transaction.amount) == 0:
         # No need to write anything for 0-transactions, should they occur
         return
@@ -589,17 +760,6 @@ async def record_transaction(transaction: Transaction):
     await actors.write_financial_record(transaction, record_payer, record_recip)
 
 
-def record_transaction_internal(transaction: Transaction):
-    if transaction.payer_actor is not None:
-        payer_record = InternalTransRecord.from_transaction(transaction, for_payer=True)
-        add_internal_record(transaction.payer, payer_record)
-    if transaction.recip_actor is not None:
-        recip_record = InternalTransRecord.from_transaction(
-            transaction, for_payer=False
-        )
-        add_internal_record(transaction.recip, recip_record)
-
-
 async def generate_record_for_payer(transaction: Transaction):
     if transaction.payer_actor is None:
         return None
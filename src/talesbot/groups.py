@@ -7,7 +7,6 @@
 # and "finance and chat capabilities", which only players and shops have
 # (this would avoid the double-implementation of access roles that currently exists between groups and actors)
 
-import asyncio
 import logging
 from typing import Dict, List, cast
 
@@ -16,7 +15,7 @@ import simplejson
 from configobj import ConfigObj
 
 # Custom imports
-from . import channels, common, handles, players, server
+from . import channels, common, handles, players, role_cleanup, server
 from .common import group_role_start, highest_ever_index
 from .config import config_dir
 from .custom_types import Handle, HandleTypes
@@ -141,18 +140,14 @@ async def clear_group(group_id: str, spare_used: bool):
 
 
 async def delete_all_group_roles(spare_used: bool):
-    task_list = (
-        asyncio.create_task(delete_if_group_role(r, spare_used))
-        for guild in server.get_guilds()
-        for r in guild.roles
-    )
-    await asyncio.gather(*task_list)
-
-
-async def delete_if_group_role(role, spare_used: bool):
-    if common.is_group_role(role.name):
-        if not spare_used or len(role.members) == 0:
-            await role.delete()
+    # The roles of groups that still exist are kept as well
+    groups = ConfigObj(groups_file_name)
+    group_indexes = [
+        Group.from_string(groups[group_id]).group_index
+        for group_id in groups
+        if group_id != highest_ever_index
+    ]
+    await role_cleanup.delete_roles(common.is_group_role, group_indexes, spare_used)
 
 
 def get_group_role(guild, group_id: str):
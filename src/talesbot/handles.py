@@ -1,6 +1,8 @@
 import asyncio
 import re
+from copy import copy
 from enum import Enum
+from typing import cast
 
 from configobj import ConfigObj
 from discord import Interaction, app_commands
@@ -8,7 +10,7 @@ from discord.ext import commands
 
 from talesbot import checks
 
-from . import actors, chats, finances, game, gm, players
+from . import actors, chats, finances, game, gm, players, snapshot
 from .common import coin
 from .config import config_dir
 from .custom_types import ActionResult, Handle, HandleTypes
@@ -150,16 +152,73 @@ active_index = "___active"
 last_regular_index = "___last_regular"
 handles_index = "___all_handles"
 
+# The handle files are parsed once (in init) and then kept in memory.
+# All changes are written straight through to the files, so the files are always
+# up to date, but no lookup needs to touch the disk.
+handles_confobj: ConfigObj | None = None
+actor_handles_confobjs: dict[str, ConfigObj] = {}
+# handle_id -> Handle, and actor_id -> {handle_id -> Handle}
+handles_by_id: dict[str, Handle] = {}
+handles_by_actor: dict[str, dict[str, Handle]] = {}
+
 
 def get_handles_confobj():
-    handles = ConfigObj(str(config_dir / handles_conf_dir / "__handles.conf"))
+    global handles_confobj
+    if handles_confobj is None:
+        load_handles_store()
+    return cast(ConfigObj, handles_confobj)
+
+
+def load_handles_store():
+    global handles_confobj
+    handles = snapshot.load_conf(str(config_dir / handles_conf_dir / "__handles.conf"))
     if handles_to_actors not in handles:
         handles[handles_to_actors] = {}
         handles.write()
     if actors_index not in handles:
         handles[actors_index] = {}
         handles.write()
-    return handles
+    handles_confobj = handles
+    actor_handles_confobjs.clear()
+    handles_by_id.clear()
+    handles_by_actor.clear()
+    for actor_id in handles[actors_index]:
+        get_actor_handles_confobj(actor_id)
+
+
+def get_actor_handles_confobj(actor_id: str):
+    if actor_id not in actor_handles_confobjs:
+        file_name = str(config_dir / handles_conf_dir / f"{actor_id}.conf")
+        actor_handles_conf = snapshot.load_conf(file_name)
+        actor_handles_confobjs[actor_id] = actor_handles_conf
+        actor_handles = handles_by_actor.setdefault(actor_id, {})
+        if handles_index in actor_handles_conf:
+            for handle_id in actor_handles_conf[handles_index]:
+                handle = read_handle(actor_handles_conf, handle_id)
+                actor_handles[handle.handle_id] = handle
+                # If a handle is (erroneously) listed for more than one actor,
+                # the first one wins -- same as when scanning the files in order
+                handles_by_id.setdefault(handle.handle_id, handle)
+    return actor_handles_confobjs[actor_id]
+
+
+def _index_handle(handle: Handle):
+    handles_by_actor.setdefault(cast(str, handle.actor_id), {})[handle.handle_id] = (
+        handle
+    )
+    handles_by_id[handle.handle_id] = handle
+
+
+def _unindex_handle(handle_id: str, actor_id: str | None):
+    if actor_id in handles_by_actor:
+        handles_by_actor[actor_id].pop(handle_id, None)
+    if handle_id in handles_by_id and handles_by_id[handle_id].actor_id == actor_id:
+        del handles_by_id[handle_id]
+
+
+def _unindex_actor(actor_id: str):
+    for handle_id in list(handles_by_actor.get(actor_id, {})):
+        _unindex_handle(handle_id, actor_id)
 
 
 # May contain letters, numbers and underscores
@@ -190,12 +249,7 @@ def is_forbidden_handle(new_handle: str):
 
 
 async def init(clear_all: bool = False):
-    handles = get_handles_confobj()
-    if handles_to_actors not in handles:
-        handles[handles_to_actors] = {}
-    if actors_index not in handles:
-        handles[actors_index] = {}
-    handles.write()
+    load_handles_store()
     if clear_all:
         await clear_all_handles()
 
@@ -211,7 +265,7 @@ async def clear_all_handles():
 
 async def clear_all_handles_for_actor(actor_id: str):
     handles = get_handles_confobj()
-    for handle in get_handles_for_actor(actor_id, include_burnt=True):
+    for handle in list(get_handles_for_actor(actor_id, include_burnt=True)):
         await clear_handle(handle)
     if actor_id in handles[actors_index]:
         del handles[actors_index][actor_id]
@@ -225,12 +279,12 @@ async def clear_handle(handle: Handle):
     if handle.handle_id in handles[handles_to_actors]:
         del handles[handles_to_actors][handle.handle_id]
         handles.write()
-        file_name = str(config_dir / handles_conf_dir / f"{handle.actor_id}.conf")
-        actor_handles_conf = ConfigObj(file_name)
+        actor_handles_conf = get_actor_handles_confobj(cast(str, handle.actor_id))
         if handles_index in actor_handles_conf:
             if handle.handle_id in actor_handles_conf[handles_index]:
                 del actor_handles_conf[handles_index][handle.handle_id]
                 actor_handles_conf.write()
+        _unindex_handle(handle.handle_id, handle.actor_id)
 
 
 async def init_handles_for_actor(
@@ -242,12 +296,12 @@ async def init_handles_for_actor(
     if overwrite or actor_id not in handles[actors_index]:
         handles[actors_index][actor_id] = {}
         handles.write()
-        file_name = str(config_dir / handles_conf_dir / f"{actor_id}.conf")
-        actor_handles_conf = ConfigObj(file_name)
+        actor_handles_conf = get_actor_handles_confobj(actor_id)
         for entry in actor_handles_conf:
             del actor_handles_conf[entry]
         actor_handles_conf[handles_index] = {}
         actor_handles_conf.write()
+        _unindex_actor(actor_id)
         handle: Handle = await create_handle(
             actor_id, first_handle, HandleTypes.Regular, force_reserved=True
         )
@@ -255,15 +309,23 @@ async def init_handles_for_actor(
 
 
 def store_handle(handle: Handle):
+    actor_id = cast(str, handle.actor_id)
     handles = get_handles_confobj()
-    handles[actors_index][handle.actor_id] = {}
-    handles[handles_to_actors][handle.handle_id] = handle.actor_id
-    handles.write()
+    # Only rewrite the shared file if the handle -> actor mapping actually changes
+    if (
+        actor_id not in handles[actors_index]
+        or handles[handles_to_actors].get(handle.handle_id) != actor_id
+    ):
+        handles[actors_index][actor_id] = {}
+        handles[handles_to_actors][handle.handle_id] = actor_id
+        handles.write()
 
-    file_name = str(config_dir / handles_conf_dir / f"{handle.actor_id}.conf")
-    actor_handles_conf = ConfigObj(file_name)
+    actor_handles_conf = get_actor_handles_confobj(actor_id)
+    if handles_index not in actor_handles_conf:
+        actor_handles_conf[handles_index] = {}
     actor_handles_conf[handles_index][handle.handle_id] = handle.to_string()
     actor_handles_conf.write()
+    _index_handle(copy(handle))
 
 
 async def create_handle(
@@ -282,11 +344,11 @@ async def create_handle(
     result: HandleAllowedResult = is_forbidden_handle(handle_id)
     if result == HandleAllowedResult.Allowed:
         store_handle(handle)
-        finances.init_finances_for_handle(handle)
+        await finances.init_finances_for_handle(handle)
     elif result == HandleAllowedResult.Reserved:
         if force_reserved:
             store_handle(handle)
-            finances.init_finances_for_handle(handle)
+            await finances.init_finances_for_handle(handle)
         else:
             handle.handle_type = HandleTypes.Reserved
     else:
@@ -295,50 +357,44 @@ async def create_handle(
 
 
 def read_handle(actor_handles, handle_id: str):
-    get_handles_confobj()
     # Unprotected -- only use for handles that you know exist
     return Handle.from_string(actor_handles[handles_index][handle_id])
 
 
+# The lookups below never touch the disk. They hand out copies, so that callers
+# can edit the returned handle without changing the stored one (use store_handle)
+
+
 def get_active_handle_id(actor_id: str):
     handles = get_handles_confobj()
     if actor_id in handles[actors_index]:
-        file_name = str(config_dir / handles_conf_dir / f"{actor_id}.conf")
-        actor_handles_conf = ConfigObj(file_name)
+        actor_handles_conf = get_actor_handles_confobj(actor_id)
         if active_index in actor_handles_conf:
             return actor_handles_conf[active_index]
 
 
 def get_active_handle(actor_id: str):
-    handles = get_handles_confobj()
-    if actor_id in handles[actors_index]:
-        file_name = str(config_dir / handles_conf_dir / f"{actor_id}.conf")
-        actor_handles_conf = ConfigObj(file_name)
-        if active_index in actor_handles_conf:
-            active_id = actor_handles_conf[active_index]
-            if active_id in actor_handles_conf[handles_index]:
-                handle = read_handle(actor_handles_conf, active_id)
-                return handle
+    active_id = get_active_handle_id(actor_id)
+    if active_id is not None:
+        handle = handles_by_actor[actor_id].get(active_id)
+        if handle is not None:
+            return copy(handle)
 
 
 def get_last_regular_id(actor_id: str):
     handles = get_handles_confobj()
     if actor_id in handles[actors_index]:
-        file_name = str(config_dir / handles_conf_dir / f"{actor_id}.conf")
-        actor_handles_conf = ConfigObj(file_name)
+        actor_handles_conf = get_actor_handles_confobj(actor_id)
         if last_regular_index in actor_handles_conf:
             return actor_handles_conf[last_regular_index]
 
 
 def get_last_regular(actor_id: str):
-    handles = get_handles_confobj()
-    if actor_id in handles[actors_index]:
-        file_name = str(config_dir / handles_conf_dir / f"{actor_id}.conf")
-        actor_handles_conf = ConfigObj(file_name)
-        if last_regular_index in actor_handles_conf:
-            last_regular_id = actor_handles_conf[last_regular_index]
-            if last_regular_id in actor_handles_conf[handles_index]:
-                return read_handle(actor_handles_conf, last_regular_id)
+    last_regular_id = get_last_regular_id(actor_id)
+    if last_regular_id is not None:
+        handle = handles_by_actor[actor_id].get(last_regular_id)
+        if handle is not None:
+            return copy(handle)
 
 
 def get_all_handles():
@@ -350,16 +406,14 @@ def get_all_handles():
 def get_handle(handle_name: str):
     handle_id = handle_name.lower()
     handles = get_handles_confobj()
-    for actor_id in handles[actors_index]:
-        for handle in get_handles_for_actor(actor_id, include_burnt=True):
-            if handle.handle_id == handle_id:
-                return handle
+    handle = handles_by_id.get(handle_id)
+    if handle is not None and handle.actor_id in handles[actors_index]:
+        return copy(handle)
     return Handle(handle_id, handle_type=HandleTypes.Unused)
 
 
 def switch_to_handle(handle: Handle):
-    file_name = str(config_dir / handles_conf_dir / f"{handle.actor_id}.conf")
-    actor_handles_conf = ConfigObj(file_name)
+    actor_handles_conf = get_actor_handles_confobj(cast(str, handle.actor_id))
     actor_handles_conf[active_index] = handle.handle_id
     if handle.handle_type == HandleTypes.Regular:
         actor_handles_conf[last_regular_index] = handle.handle_id
@@ -378,12 +432,10 @@ def get_handles_for_actor(
 
 
 def get_handles_for_actor_of_types(actor_id: str, types_list: list[HandleTypes]):
-    file_name = str(config_dir / handles_conf_dir / f"{actor_id}.conf")
-    actor_handles_conf = ConfigObj(file_name)
-    for handle_id in actor_handles_conf[handles_index]:
-        handle = read_handle(actor_handles_conf, handle_id)
+    get_actor_handles_confobj(actor_id)
+    for handle in list(handles_by_actor.get(actor_id, {}).values()):
         if handle.handle_type in types_list:
-            yield handle
+            yield copy(handle)
 
 
 ### Methods directly related to commands
@@ -625,7 +677,7 @@ async def destroy_burner(burner: Handle):
         new_active = active
 
     # Rescue any money about to be burned
-    balance = finances.get_current_balance(burner)
+    balance = await finances.get_current_balance(burner)
     if balance > 0:
         await finances.transfer_from_burner(burner, new_active, balance)
 
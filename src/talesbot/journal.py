@@ -0,0 +1,116 @@
+import os
+from collections.abc import Iterator
+
+import simplejson
+
+### Module journal.py
+# A dict that lives in memory and is persisted as an append-only file (JSON Lines).
+# Every change appends one line instead of rewriting the whole file, and reads never
+# touch the disk. When the file has grown much larger than the data it holds,
+# it is compacted by writing out the current contents once.
+
+compact_min_lines = 256
+compact_factor = 4
+
+
+class JournaledDict:
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.data: dict[str, str] = {}
+        self.journal_lines = 0
+        self.load()
+
+    def load(self):
+        self.data = {}
+        self.journal_lines = 0
+        if not os.path.exists(self.file_name):
+            return
+        with open(self.file_name, "rb") as f:
+            lines = f.readlines()
+        offset = 0
+        for i, line in enumerate(lines):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("unterminated line")
+                change = simplejson.loads(line) if line.strip() else None
+            except ValueError:
+                if i < len(lines) - 1:
+                    raise
+                # Half-written last change, it is cut off below
+                break
+            offset += len(line)
+            if change is None:
+                continue
+            self.journal_lines += 1
+            if "v" in change:
+                self.data[change["k"]] = change["v"]
+            else:
+                self.data.pop(change["k"], None)
+        if offset != sum(len(line) for line in lines):
+            with open(self.file_name, "r+b") as f:
+                f.truncate(offset)
+
+    def exists(self):
+        return os.path.exists(self.file_name)
+
+    def __contains__(self, key: str):
+        return key in self.data
+
+    def __getitem__(self, key: str) -> str:
+        return self.data[key]
+
+    def get(self, key: str, default: str | None = None) -> str | None:
+        return self.data.get(key, default)
+
+    def __iter__(self) -> Iterator[str]:
+        # Iterate over a copy, so that entries can be deleted while looping
+        return iter(list(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+    def items(self):
+        return list(self.data.items())
+
+    def values(self):
+        return list(self.data.values())
+
+    def __setitem__(self, key: str, value: str):
+        if self.data.get(key) == value:
+            return
+        self.data[key] = value
+        self._append({"k": key, "v": value})
+
+    def __delitem__(self, key: str):
+        del self.data[key]
+        self._append({"k": key})
+
+    def update(self, values: dict[str, str]):
+        changes = [
+            {"k": key, "v": value}
+            for (key, value) in values.items()
+            if self.data.get(key) != value
+        ]
+        self.data.update(values)
+        self._append(*changes)
+
+    def clear(self):
+        self.data = {}
+        self.compact()
+
+    def compact(self):
+        tmp_file_name = f"{self.file_name}.tmp"
+        with open(tmp_file_name, "w", encoding="utf-8") as f:
+            for key, value in self.data.items():
+                f.write(simplejson.dumps({"k": key, "v": value}) + "\n")
+        os.replace(tmp_file_name, self.file_name)
+        self.journal_lines = len(self.data)
+
+    def _append(self, *changes: dict):
+        if not changes:
+            return
+        with open(self.file_name, "a", encoding="utf-8") as f:
+            f.writelines(simplejson.dumps(change) + "\n" for change in changes)
+        self.journal_lines += len(changes)
+        if self.journal_lines > max(compact_min_lines, compact_factor * len(self.data)):
+            self.compact()
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator, Hashable
+from contextlib import asynccontextmanager
+
+### Module keyed_lock.py
+# One asyncio lock per key (e.g. per user), created on first use and dropped again
+# as soon as nobody holds it or waits for it. The registry therefore only ever
+# contains the keys that are busy right now, no matter how many keys have been used.
+# It also keeps track of how long callers wait, to spot one key stalling the rest.
+
+logger = logging.getLogger(__name__)
+
+
+class _KeyEntry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Holding the lock or waiting for it
+        self.users = 0
+
+
+class KeyedLock:
+    def __init__(self, name: str, slow_wait: float = 5.0):
+        self.name = name
+        # Waits longer than this (in seconds) are logged
+        self.slow_wait = slow_wait
+        self.entries: dict[Hashable, _KeyEntry] = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.acquired = 0
+        self.slow_waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_queue_depth = 0
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = _KeyEntry()
+            self.entries[key] = entry
+        entry.users += 1
+        self.max_queue_depth = max(self.max_queue_depth, entry.users)
+        start = time.perf_counter()
+        try:
+            async with entry.lock:
+                self._record_wait(key, time.perf_counter() - start, entry.users)
+                yield
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                del self.entries[key]
+
+    def _record_wait(self, key: Hashable, wait: float, queue_depth: int):
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if wait > self.slow_wait:
+            self.slow_waits += 1
+            logger.warning(
+                f"Waited {wait:.1f} s for {self.name} lock of {key} "
+                f"({queue_depth - 1} more in queue)"
+            )
+
+    def queue_depth(self, key: Hashable) -> int:
+        entry = self.entries.get(key)
+        return 0 if entry is None else entry.users
+
+    def stats(self, top: int = 5) -> dict:
+        busiest = sorted(self.entries.items(), key=lambda e: e[1].users, reverse=True)
+        return {
+            "active_keys": len(self.entries),
+            "queue_depths": {str(key): e.users for (key, e) in busiest[:top]},
+            "max_queue_depth": self.max_queue_depth,
+            "acquired": self.acquired,
+            "mean_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+            "max_wait": self.max_wait,
+            "slow_waits": self.slow_waits,
+        }
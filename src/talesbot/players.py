@@ -7,7 +7,7 @@ from configobj import ConfigObj
 
 from talesbot import gm
 
-from . import actors, channels, common, player_setup, server, shops
+from . import actors, channels, common, player_setup, role_cleanup, server, shops
 from .common import (
     admin_role_name,
     highest_ever_index,
@@ -55,18 +55,9 @@ async def init(clear_all=False):
 
 
 async def _delete_all_player_roles(spare_used: bool):
-    task_list = (
-        asyncio.create_task(delete_if_player_role(r, spare_used))
-        for guild in server.get_guilds()
-        for r in guild.roles
+    await role_cleanup.delete_roles(
+        common.is_player_role, actors.get_all_actor_role_names(), spare_used
     )
-    await asyncio.gather(*task_list)
-
-
-async def delete_if_player_role(role, spare_used: bool):
-    if common.is_player_role(role.name):
-        if not spare_used or len(role.members) == 0:
-            await role.delete()
 
 
 async def _clear_player(player_id: str):
@@ -1,5 +1,6 @@
 import asyncio
 import re
+from collections import OrderedDict
 
 import discord
 
@@ -45,6 +46,34 @@ def read_handle_from_post(post: str):
         return None
 
 
+# Author index: reposted message id -> handle of the author, so that reactions can
+# find who wrote a post without reading the channel history.
+# Only the most recent posts are kept; older ones fall back to reading the history.
+post_authors: OrderedDict[int, str] = OrderedDict()
+post_authors_max_size = 10000
+
+
+def record_post_author(message_id: int, author: str):
+    post_authors[message_id] = author
+    post_authors.move_to_end(message_id)
+    while len(post_authors) > post_authors_max_size:
+        post_authors.popitem(last=False)
+
+
+def record_reposted_message(message: discord.Message, author: str | None):
+    # Posts without a known author are left to the history lookup
+    if author is not None:
+        # Lower case, just like the handle read from a post header
+        record_post_author(message.id, author.lower())
+
+
+def get_post_author(message_id: int):
+    author = post_authors.get(message_id)
+    if author is not None:
+        post_authors.move_to_end(message_id)
+    return author
+
+
 def starts_with_bold(content: str):
     return content.startswith(forbidden_content)
 
@@ -83,12 +112,18 @@ def create_post(
 
 
 # TODO: pass in "full_post : bool" instead of checking sender == None
+# author: who wrote the post, also when it continues an earlier one without header
 async def repost_message_to_channel(
-    channel, msg_data: MessageData, sender: str | None, recip: str | None = None
+    channel,
+    msg_data: MessageData,
+    sender: str | None,
+    recip: str | None = None,
+    author: str | None = None,
 ):
     post = create_post(msg_data, sender, recip)
     files = [await a.to_file() for a in msg_data.attachments]
-    await channel.send(post, files=files)
+    message = await channel.send(post, files=files)
+    record_reposted_message(message, sender if author is None else author)
 
 
 async def process_open_message(message, anonymous=False):
@@ -125,6 +160,13 @@ async def process_open_message(message, anonymous=False):
             )
         else:
             tasks.append(
-                asyncio.create_task(repost_message_to_channel(channel, msg_data, None))
+                asyncio.create_task(
+                    repost_message_to_channel(
+                        channel,
+                        msg_data,
+                        None,
+                        author=current_poster_display_name,
+                    )
+                )
             )
     await asyncio.gather(*tasks)
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from collections.abc import Iterable
+
+import discord
+
+### Module reaction_seeding.py
+# Puts the bot's own reactions on a message (menus, tipping buttons and so on).
+# Emojis the bot has already reacted with are skipped, so seeding a message that is
+# already up to date costs no requests at all. The missing ones are added with a
+# few requests in flight, and a reaction that hits a rate limit is retried later.
+# With more than one request in flight, Discord may show the reactions slightly
+# out of order.
+
+seed_concurrency = 3
+seed_retries = 3
+# Seconds to wait after a rate limit that did not say how long to wait
+seed_retry_delay = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def own_reactions(message) -> list[str]:
+    return [str(reaction.emoji) for reaction in message.reactions if reaction.me]
+
+
+async def seed_reactions(
+    message,
+    emojis: Iterable[str],
+    concurrency: int = seed_concurrency,
+    retries: int = seed_retries,
+) -> int:
+    # Returns the number of reactions that were added
+    present = set(own_reactions(message))
+    missing = [emoji for emoji in dict.fromkeys(emojis) if emoji not in present]
+    if not missing:
+        return 0
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def add(emoji: str):
+        async with limiter:
+            await _add_reaction(message, emoji, retries)
+
+    await asyncio.gather(*(add(emoji) for emoji in missing))
+    return len(missing)
+
+
+async def _add_reaction(message, emoji: str, retries: int):
+    for attempt in range(retries + 1):
+        try:
+            await message.add_reaction(emoji)
+            return
+        except discord.RateLimited as e:
+            # discord.py gave up waiting for the rate limit itself
+            if attempt == retries:
+                raise
+            delay = e.retry_after
+        except discord.HTTPException as e:
+            if e.status != 429 or attempt == retries:
+                raise
+            delay = seed_retry_delay * 2**attempt
+        logger.warning(
+            f"Rate limited adding reaction {emoji} to message {message.id}, "
+            f"retrying in {delay:.1f} s"
+        )
+        await asyncio.sleep(delay)
@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import datetime
 import logging
 
@@ -17,6 +18,7 @@ from . import (
 )
 from .common import coin
 from .custom_types import ActionResult
+from .keyed_lock import KeyedLock
 
 # good-to-have emojis:
 # ✅
@@ -32,15 +34,54 @@ logger = logging.getLogger(__name__)
 
 
 def init():
-    clear_reaction_semaphores()
-
-
-async def remove_reaction(message, emoji, user_id: int):
-    member = await message.channel.guild.fetch_member(user_id)
+    # The locks themselves clean up after every reaction
+    reaction_locks.reset_stats()
+
+
+class ReactionContext:
+    # One reaction being processed. Holds on to the message and member once they
+    # have been looked up, so the handlers never fetch the same thing twice.
+    # None of the handlers need the content of the message, only its id and channel,
+    # so if the gateway has not cached the message a partial message is used instead
+    # of fetching it.
+    def __init__(
+        self,
+        message_id: int,
+        user_id: int,
+        channel,
+        emoji,
+        member: discord.Member | None = None,
+        cached_message: discord.Message | None = None,
+    ):
+        self.message_id = message_id
+        self.user_id = user_id
+        self.channel = channel
+        self.emoji = emoji
+        self._member = member
+        self._message = cached_message
+
+    def message(self) -> discord.Message | discord.PartialMessage:
+        if self._message is None:
+            self._message = self.channel.get_partial_message(self.message_id)
+        return self._message
+
+    def cached_member(self) -> discord.Member | None:
+        if self._member is None:
+            self._member = self.channel.guild.get_member(self.user_id)
+        return self._member
+
+    async def member(self) -> discord.Member | None:
+        if self.cached_member() is None:
+            self._member = await self.channel.guild.fetch_member(self.user_id)
+        return self._member
+
+    async def remove_reaction(self):
+        await remove_reaction(self.message(), self.emoji, await self.member())
+
+
+async def remove_reaction(message, emoji, member: discord.Member | None):
     if member is None:
-        logger.error(
-            f"tried to remove reaction but member not found, user_id is {user_id}"
-        )
+        logger.error(f"tried to remove reaction {emoji} but member not found")
     else:
         await message.remove_reaction(emoji, member)
 
@@ -65,9 +106,18 @@ class ReactionRecipientSearchResult:
     recipient: str = None
 
 
-async def find_reaction_recipient_and_message(message_id: int, channel):
+async def find_reaction_recipient_and_message(context: ReactionContext):
     result = ReactionRecipientSearchResult()
-    partial_message = channel.get_partial_message(message_id)
+    message_id = context.message_id
+    channel = context.channel
+    partial_message = context.message()
+
+    author = posting.get_post_author(message_id)
+    if author is not None:
+        # The partial message is enough to remove the reaction again if needed
+        result.message = partial_message
+        result.recipient = author
+        return result
 
     epsilon = datetime.timedelta(milliseconds=500)
     timestamp = partial_message.created_at + epsilon
@@ -81,53 +131,177 @@ async def find_reaction_recipient_and_message(message_id: int, channel):
         if match is not None:
             # print(f'Recorded reaction on post by {match}')
             result.recipient = match
+            posting.record_post_author(message_id, match)
             break
     return result
 
 
-async def process_reaction_on_other_handle(
-    message_id: int, user_id: int, channel, emoji
-):
+async def process_reaction_on_other_handle(context: ReactionContext):
     search_result: ReactionRecipientSearchResult = (
-        await find_reaction_recipient_and_message(message_id, channel)
+        await find_reaction_recipient_and_message(context)
     )
     if search_result.recipient is None:
-        logger.error(f"Could not find recipient for message in channel {channel.name}.")
+        logger.error(
+            f"Could not find recipient for message in channel {context.channel.name}."
+        )
         return
 
     # Currently only one use case for reading reactions, and that is for paying money
-    emoji_str = str(emoji)
+    emoji_str = str(context.emoji)
     if emoji_str in reactions_worth_money:
         payment_amount = reactions_worth_money[emoji_str]
         if payment_amount > 0:
-            player_id = players.get_player_id(str(user_id))
-            transaction: custom_types.Transaction = (
-                await finances.try_to_pay_from_actor(
-                    player_id,
-                    search_result.recipient,
-                    payment_amount,
-                    from_reaction=True,
-                )
+            player_id = players.get_player_id(str(context.user_id))
+            add_reaction_payment(
+                context,
+                player_id,
+                search_result.recipient,
+                search_result.message,
+                payment_amount,
             )
-            if not transaction.success:
-                await remove_reaction(search_result.message, emoji, user_id)
-            await send_report_to_cmd_line(str(user_id), transaction.report)
     # elif emoji_str in chat_reactions:
 
 
-async def process_reaction_in_chat_hub(message_id: int, user_id: int, channel, emoji):
-    message = await channel.fetch_message(message_id)
-    report = await chats.process_reaction_in_chat_hub(message, str(emoji))
-    await send_report_to_cmd_line(str(user_id), report)
+### Reaction payments:
+# A popular post can get a lot of money reactions in a few seconds. Instead of one
+# transfer (and one financial record) per click, the reactions are collected per
+# (payer, recipient) for reaction_payment_window seconds and then settled together.
+
+reaction_payment_window: float = 2.0
+
+
+class PendingReactionPayment:
+    def __init__(self, context: ReactionContext, player_id: str, recipient: str):
+        self.user_id = context.user_id
+        # Kept to look up the member, should any reactions have to be removed
+        self.context = context
+        self.player_id = player_id
+        self.recipient = recipient
+        # (message, emoji, amount) for every reaction, in the order they came in
+        self.reactions: list[
+            tuple[discord.Message | discord.PartialMessage, object, int]
+        ] = []
+        self.settling: asyncio.Task | None = None
+
+    def amount(self):
+        return sum(amount for (_, _, amount) in self.reactions)
+
+
+pending_reaction_payments: dict[tuple[str, str], PendingReactionPayment] = {}
+# The event loop only keeps weak references to tasks, so the settling tasks are
+# kept here until they are done
+settling_tasks: set[asyncio.Task] = set()
+
+
+def _settling_done(task: asyncio.Task):
+    settling_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Failed to settle reaction payment", exc_info=task.exception())
+
+
+def add_reaction_payment(
+    context: ReactionContext, player_id: str, recipient: str, message, amount: int
+):
+    key = (player_id, recipient)
+    payment = pending_reaction_payments.get(key)
+    if payment is None:
+        payment = PendingReactionPayment(context, player_id, recipient)
+        pending_reaction_payments[key] = payment
+        payment.settling = asyncio.create_task(settle_reaction_payment_later(key))
+        settling_tasks.add(payment.settling)
+        payment.settling.add_done_callback(_settling_done)
+    payment.reactions.append((message, context.emoji, amount))
+
+
+async def settle_reaction_payment_later(key: tuple[str, str]):
+    await asyncio.sleep(reaction_payment_window)
+    payment = pending_reaction_payments.pop(key, None)
+    if payment is not None:
+        await settle_reaction_payment(payment)
+
+
+async def settle_all_reaction_payments():
+    # Used on shutdown, so that no reactions are left unpaid
+    payments = list(pending_reaction_payments.values())
+    pending_reaction_payments.clear()
+    waiting = {payment.settling for payment in payments}
+    for task in waiting:
+        if task is not None:
+            task.cancel()
+    # Payments that are being settled right now are waited for as well;
+    # their failures are logged by _settling_done
+    in_progress = [task for task in settling_tasks if task not in waiting]
+    results = await asyncio.gather(
+        *(settle_reaction_payment(p) for p in payments),
+        *in_progress,
+        return_exceptions=True,
+    )
+    for result in results[: len(payments)]:
+        if isinstance(result, Exception):
+            logger.error("Failed to settle reaction payment", exc_info=result)
+
+
+async def settle_reaction_payment(payment: PendingReactionPayment):
+    reactions = payment.reactions
+    transaction: custom_types.Transaction = await finances.try_to_pay_from_actor(
+        payment.player_id, payment.recipient, payment.amount(), from_reaction=True
+    )
+    paid = len(reactions) if transaction.success else 0
+    report = transaction.report
+    if (
+        not transaction.success
+        and len(reactions) > 1
+        and transaction.recip_actor is not None
+        and transaction.payer != transaction.recip
+    ):
+        # Not enough money for all of them: pay for as many reactions as possible,
+        # in the order they were made
+        available = await finances.get_current_balance_handle_id(transaction.payer)
+        affordable = 0
+        while paid < len(reactions) and affordable + reactions[paid][2] <= available:
+            affordable += reactions[paid][2]
+            paid += 1
+        if paid > 0:
+            transaction = await finances.try_to_pay_from_actor(
+                payment.player_id, payment.recipient, affordable, from_reaction=True
+            )
+            if transaction.success:
+                report = (
+                    f"Transferred {coin} **{affordable}** from {transaction.payer} "
+                    f"to {transaction.recip} based on your reactions "
+                    f"(emoji), but there was not enough left for "
+                    f"{len(reactions) - paid} more."
+                )
+            else:
+                paid = 0
+
+    if paid < len(reactions):
+        # The member may not be in the gateway cache, in which case it is fetched
+        try:
+            member = await payment.context.member()
+        except discord.HTTPException:
+            member = None
+        removals = [
+            asyncio.create_task(remove_reaction(message, emoji, member))
+            for (message, emoji, _) in reactions[paid:]
+        ]
+        await asyncio.gather(*removals, return_exceptions=True)
+        await send_report_to_cmd_line(str(payment.user_id), report)
+
+
+async def process_reaction_in_chat_hub(context: ReactionContext):
+    report = await chats.process_reaction_in_chat_hub(
+        context.message(), str(context.emoji)
+    )
+    await send_report_to_cmd_line(str(context.user_id), report)
 
 
-async def process_reaction_in_storefront(message_id: int, user_id: int, channel, emoji):
-    message = await channel.fetch_message(message_id)
+async def process_reaction_in_storefront(context: ReactionContext):
     result: ActionResult = await shops.process_reaction_in_storefront(
-        message, str(user_id), str(emoji)
+        context.message(), str(context.user_id), str(context.emoji)
     )
     if not result.success:
-        await send_report_to_cmd_line(str(user_id), result.report)
+        await send_report_to_cmd_line(str(context.user_id), result.report)
 
 
 async def send_report_to_cmd_line(user_id: str, report: str):
@@ -139,48 +313,41 @@ async def send_report_to_cmd_line(user_id: str, report: str):
                 await cmd_line_channel.send(report)
 
 
-async def process_reaction_in_finance_channel(
-    message_id: int, user_id: int, channel, emoji
-):
+async def process_reaction_in_finance_channel(context: ReactionContext):
     await actors.process_reaction_in_finance_channel(
-        str(channel.id), str(message_id), str(emoji)
+        str(context.channel.id), str(context.message_id), str(context.emoji)
     )
 
 
-async def process_reaction_in_order_flow(message_id: int, user_id: int, channel, emoji):
-    await channel.fetch_message(message_id)
+async def process_reaction_in_order_flow(context: ReactionContext):
     result: ActionResult = await shops.process_reaction_in_order_flow(
-        str(channel.id), str(message_id), str(emoji)
+        str(context.channel.id), str(context.message_id), str(context.emoji)
     )
     if not result.success and result.report is not None:
-        await channel.send(content=result.report, delete_after=5)
-
-
-reactions_semaphores = {}
+        await context.channel.send(content=result.report, delete_after=5)
 
 
-def get_reaction_semaphore(user_id: str):
-    if reactions_semaphores.get(user_id) is None:
-        reactions_semaphores[user_id] = asyncio.Semaphore(1)
-    return reactions_semaphores[user_id]
+# Only one reaction per user is processed at a time
+reaction_locks = KeyedLock("reaction")
 
 
-def clear_reaction_semaphores():
-    global reactions_semaphores
-    for sem_id in reactions_semaphores:
-        del reactions_semaphores[sem_id]
+def get_reaction_stats():
+    return {
+        "locks": reaction_locks.stats(),
+        "channel_lookups": dict(channels.channel_lookups),
+    }
 
 
-async def process_reaction_add(message_id: int, user_id: int, channel, emoji):
+async def process_reaction_add(context: ReactionContext):
+    channel = context.channel
     if not game.can_process_reactions() and not channels.is_chat_hub(channel.name):
         # Remove the reaction
-        message = await channel.fetch_message(message_id)
-        await remove_reaction(message, emoji, user_id)
+        await context.remove_reaction()
         return
 
-    # Semaphore handling to ensure we only process one action per player at a time:
-    async with get_reaction_semaphore(user_id):
-        logger.debug(f"User reacted with {emoji}")
+    # Lock to ensure we only process one action per player at a time:
+    async with reaction_locks.hold(context.user_id):
+        logger.debug(f"User reacted with {context.emoji}")
         should_remove_reaction = True
         try:
             if channels.is_anonymous_channel(channel):
@@ -190,24 +357,16 @@ async def process_reaction_add(message_id: int, user_id: int, channel, emoji):
                 # Reactions in cmd_line are silently swallowed
                 pass
             elif channels.is_chat_hub(channel.name):
-                await process_reaction_in_chat_hub(message_id, user_id, channel, emoji)
+                await process_reaction_in_chat_hub(context)
                 should_remove_reaction = False  # Not needed after this
             elif channels.is_shop_channel(channel):
-                await process_reaction_in_storefront(
-                    message_id, user_id, channel, emoji
-                )
+                await process_reaction_in_storefront(context)
             elif channels.is_finance(channel.name):
-                await process_reaction_in_finance_channel(
-                    message_id, user_id, channel, emoji
-                )
+                await process_reaction_in_finance_channel(context)
             elif channels.is_order_flow(channel.name):
-                await process_reaction_in_order_flow(
-                    message_id, user_id, channel, emoji
-                )
+                await process_reaction_in_order_flow(context)
             else:
-                await process_reaction_on_other_handle(
-                    message_id, user_id, channel, emoji
-                )
+                await process_reaction_on_other_handle(context)
                 should_remove_reaction = (
                     False  # Reaction should stay unless removed by above function
                 )
@@ -216,9 +375,6 @@ async def process_reaction_add(message_id: int, user_id: int, channel, emoji):
             pass
 
     if should_remove_reaction:
-        try:
-            message = await channel.fetch_message(message_id)
-            await remove_reaction(message, emoji, user_id)
-        except discord.errors.NotFound:
-            # If the processing above has removed the message or the reaction, we just ignore it
-            pass
+        # If the processing above has removed the message or the reaction, we just ignore it
+        with contextlib.suppress(discord.errors.NotFound):
+            await context.remove_reaction()
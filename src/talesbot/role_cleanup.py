@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from collections.abc import Callable, Iterable
+
+import discord
+
+from . import server
+
+### Module role_cleanup.py
+# Deletes the roles the bot has created for players, shops and groups, across all
+# guilds. The names of the roles that are still in use are worked out once by the
+# caller and compared against the roles of every guild, so the cost does not grow
+# with the number of roles times the number of actors.
+# The deletions run with a few requests in flight. A role that is already gone
+# (e.g. deleted by another cleanup running at the same time) is skipped; any other
+# failure is raised to the caller once the other deletions have finished.
+
+role_delete_concurrency = 5
+
+logger = logging.getLogger(__name__)
+
+
+def roles_to_delete(
+    is_managed_role: Callable[[str], bool], in_use: Iterable[str], spare_used: bool
+):
+    # With spare_used, roles that are in use or still have members are kept
+    used = set(in_use) if spare_used else set()
+    return [
+        role
+        for guild in server.get_guilds()
+        for role in guild.roles
+        if is_managed_role(role.name)
+        and not (spare_used and (role.name in used or len(role.members) > 0))
+    ]
+
+
+async def delete_roles(
+    is_managed_role: Callable[[str], bool],
+    in_use: Iterable[str],
+    spare_used: bool,
+    concurrency: int = role_delete_concurrency,
+) -> int:
+    # Returns the number of roles that were deleted
+    roles = roles_to_delete(is_managed_role, in_use, spare_used)
+    if not roles:
+        return 0
+    limiter = asyncio.Semaphore(concurrency)
+    deleted = 0
+
+    async def delete(role):
+        nonlocal deleted
+        async with limiter:
+            try:
+                await role.delete()
+                deleted += 1
+            except discord.NotFound:
+                pass
+
+    results = await asyncio.gather(
+        *(delete(role) for role in roles), return_exceptions=True
+    )
+    logger.info(f"Deleted {deleted} of {len(roles)} roles")
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return deleted
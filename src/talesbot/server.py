@@ -17,6 +17,10 @@ logger = logging.getLogger(__name__)
 
 guilds = []
 guild_roles = {}
+# guild id -> channel name -> channels with that name, built from the gateway cache
+# and kept up to date by the channel events, so looking up a channel by name
+# never needs a REST call
+channels_by_name: dict[int, dict[str, list[discord.abc.GuildChannel]]] = {}
 
 # TODO: restrict reactions to only the channels where they actually do anything.
 # This is a third category I think:
@@ -51,6 +55,7 @@ public_normal_base = super_access
 async def init(connected_guilds):
     for guild in connected_guilds:
         guilds.append(guild)
+        index_guild_channels(guild)
         guild_roles[guild.id] = {}
         for role_name in [
             system_role_name,
@@ -81,6 +86,43 @@ def get_guilds():
     return guilds
 
 
+### Channel name index:
+
+
+def index_guild_channels(guild: discord.Guild):
+    channels_by_name[guild.id] = {}
+    for channel in guild.channels:
+        index_channel(channel)
+
+
+def index_channel(channel: discord.abc.GuildChannel):
+    if channel.guild.id not in channels_by_name:
+        # Not one of our guilds (yet)
+        return
+    named = channels_by_name[channel.guild.id].setdefault(channel.name, [])
+    if all(c.id != channel.id for c in named):
+        named.append(channel)
+
+
+def unindex_channel(channel: discord.abc.GuildChannel, channel_name: str | None = None):
+    by_name = channels_by_name.get(channel.guild.id, {})
+    name = channel.name if channel_name is None else channel_name
+    named = [c for c in by_name.get(name, []) if c.id != channel.id]
+    if named:
+        by_name[name] = named
+    else:
+        by_name.pop(name, None)
+
+
+def reindex_channel(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    unindex_channel(after, before.name)
+    index_channel(after)
+
+
+def get_channels_by_name_in(guild, channel_name: str):
+    return channels_by_name.get(guild.id, {}).get(channel_name, [])
+
+
 async def give_role_access(channel, role):
     if channel.guild.id != role.guild.id:
         logger.warning(
@@ -223,12 +265,9 @@ async def get_mirrored_channels(channel):
 async def get_mirrored_channels_by_name(channel_name: str):
     result = []
     for guild in guilds:
-        channels = await get_all_channels_in(guild)
-        channel_in_guild = discord.utils.find(
-            lambda c: c.name == channel_name, channels
-        )
-        if channel_in_guild:
-            result.append(channel_in_guild)
+        channels = get_channels_by_name_in(guild, channel_name)
+        if channels:
+            result.append(channels[0])
     return result
 
 
@@ -1,8 +1,14 @@
 # shops.py
 
 import asyncio
+import contextlib
 import datetime
 import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
 from copy import deepcopy
 from enum import Enum
 from typing import Dict, List, cast
@@ -16,7 +22,17 @@ from discord.ext import commands
 from talesbot import checks
 
 # Custom imports
-from . import actors, channels, common, finances, handles, players, server
+from . import (
+    actors,
+    channels,
+    common,
+    finances,
+    handles,
+    players,
+    role_cleanup,
+    server,
+    snapshot,
+)
 from .common import (
     coin,
     emoji_accept,
@@ -35,7 +51,10 @@ from .custom_types import (
     Transaction,
     TransTypes,
 )
+from .database import SessionM
+from .database import order as order_db
 from .errors import NotRegisterdError
+from .reaction_seeding import own_reactions, seed_reactions
 
 logger = logging.getLogger(__name__)
 
@@ -657,8 +676,50 @@ storefront_channel_map_index = "__storefront_channel_mapping"
 orders_channel_map_index = "__order_flow_channel_mapping"
 
 
+# The shop files are loaded once and then kept in memory, so reading shop data never
+# touches the disk. Changes are written straight away, except inside a
+# shop_data_batch(): then every changed file is written once, when the batch ends.
+# A batch only holds back the writes of the task it was entered in (and of the tasks
+# that task starts and waits for inside it); other tasks keep writing straight away.
+shop_files: dict[str, ConfigObj] = {}
+changed_shop_files: dict[str, ConfigObj] = {}
+shop_data_batch_depth: ContextVar[int] = ContextVar("shop_data_batch_depth", default=0)
+
+
+def _get_shop_file(file_name: str) -> ConfigObj:
+    conf = shop_files.get(file_name)
+    if conf is None:
+        conf = snapshot.load_conf(str(config_dir / shops_conf_dir / file_name))
+        shop_files[file_name] = conf
+    return conf
+
+
+def _write_shop_file(conf: ConfigObj):
+    if shop_data_batch_depth.get() > 0:
+        changed_shop_files[conf.filename] = conf
+    else:
+        conf.write()
+
+
+@contextmanager
+def shop_data_batch():
+    token = shop_data_batch_depth.set(shop_data_batch_depth.get() + 1)
+    try:
+        yield
+    finally:
+        shop_data_batch_depth.reset(token)
+        if shop_data_batch_depth.get() == 0:
+            flush_shop_data()
+
+
+def flush_shop_data():
+    for conf in changed_shop_files.values():
+        conf.write()
+    changed_shop_files.clear()
+
+
 def get_shops_configobj():
-    shops = ConfigObj(str(config_dir / shops_conf_dir / "__shops.conf"))
+    shops = _get_shop_file("__shops.conf")
     edited = False
     if shop_data_index not in shops:
         shops[shop_data_index] = {}
@@ -673,12 +734,14 @@ def get_shops_configobj():
         shops[orders_channel_map_index] = {}
         edited = True
     if edited:
-        shops.write()
+        _write_shop_file(shops)
     return shops
 
 
 async def init(clear_all=False):
     shops = get_shops_configobj()
+    await load_orders()
+    await migrate_order_data_confs()
     if clear_all:
         for shop_id in get_all_shop_ids():
             shop: Shop = read_shop(shop_id)
@@ -691,30 +754,20 @@ async def init(clear_all=False):
             del shops[storefront_channel_map_index][channel]
         for channel in shops[orders_channel_map_index]:
             del shops[orders_channel_map_index][channel]
-        shops.write()
+        _write_shop_file(shops)
         await channels.delete_all_shops()
 
     if clear_all:
         shops[shop_data_index][highest_ever_index] = str(shop_role_start)
-    shops.write()
+    _write_shop_file(shops)
 
     await delete_all_shop_roles(spare_used=not clear_all)
 
 
 async def delete_all_shop_roles(spare_used: bool):
-    task_list = (
-        asyncio.create_task(delete_if_shop_role(r, spare_used))
-        for guild in server.get_guilds()
-        for r in guild.roles
+    await role_cleanup.delete_roles(
+        common.is_shop_role, actors.get_all_actor_role_names(), spare_used
     )
-    await asyncio.gather(*task_list)
-
-
-async def delete_if_shop_role(role, spare_used: bool):
-    if common.is_shop_role(role.name):
-        in_use = actors.actor_index_in_use(role.name) or len(role.members) > 0
-        if not in_use or not spare_used:
-            await role.delete()
 
 
 async def reinitialize(user_id: str, shop_name: str):
@@ -745,7 +798,7 @@ def get_next_shop_index():
     prev_highest = int(shops[shop_data_index][highest_ever_index])
     shop_index = str(prev_highest + 1)
     shops[shop_data_index][highest_ever_index] = shop_index
-    shops.write()
+    _write_shop_file(shops)
     return shop_index
 
 
@@ -763,7 +816,7 @@ def get_all_shop_ids():
 def store_shop(shop: Shop):
     shops = get_shops_configobj()
     shops[shop_data_index][shop.shop_id] = shop.to_string()
-    shops.write()
+    _write_shop_file(shops)
 
 
 def read_shop(shop_name: str):
@@ -785,7 +838,7 @@ def store_storefront_channel_mapping(channel_id: str, shop_name: str):
     shop_id = shop_name.lower()
     shops = get_shops_configobj()
     shops[storefront_channel_map_index][channel_id] = shop_id
-    shops.write()
+    _write_shop_file(shops)
 
 
 def read_storefront_channel_mapping(channel_id: str):
@@ -798,7 +851,7 @@ def store_order_flow_channel_mapping(channel_id: str, shop_name: str):
     shop_id = shop_name.lower()
     shops = get_shops_configobj()
     shops[orders_channel_map_index][channel_id] = shop_id
-    shops.write()
+    _write_shop_file(shops)
 
 
 def read_order_flow_channel_mapping(channel_id: str):
@@ -814,7 +867,7 @@ product_entries_index = "___products"
 def get_catalogue(shop_name: str):
     shop_id = shop_name.lower()
     catalogue_file_name = f"{shop_id}{catalogue_suffix}"
-    return ConfigObj(str(config_dir / shops_conf_dir / catalogue_file_name))
+    return _get_shop_file(catalogue_file_name)
 
 
 def get_all_products(shop_name: str):
@@ -831,7 +884,7 @@ def store_product(shop_name: str, product: Product):
     if shop_exists(shop_name):
         catalogue = get_catalogue(shop_name)
         catalogue[product_entries_index][product.product_id] = product.to_string()
-        catalogue.write()
+        _write_shop_file(catalogue)
 
 
 def delete_product(shop_name: str, product_id: str):
@@ -839,7 +892,7 @@ def delete_product(shop_name: str, product_id: str):
         catalogue = get_catalogue(shop_name)
         if product_id in catalogue[product_entries_index]:
             del catalogue[product_entries_index][product_id]
-            catalogue.write()
+            _write_shop_file(catalogue)
 
 
 def read_product(shop_name: str, product_name: str):
@@ -859,7 +912,7 @@ def clear_catalogue(shop_name: str):
         catalogue = get_catalogue(shop_name)
         catalogue[product_entries_index] = {}
         catalogue[msg_mapping_index] = {}
-        catalogue.write()
+        _write_shop_file(catalogue)
 
 
 storefront_suffix = "_storefront.conf"
@@ -871,14 +924,14 @@ tipping_msg_index = "___tipping_msg"
 def get_storefront(shop_name: str):
     shop_id = shop_name.lower()
     storefront_file_name = f"{shop_id}{storefront_suffix}"
-    return ConfigObj(str(config_dir / shops_conf_dir / storefront_file_name))
+    return _get_shop_file(storefront_file_name)
 
 
 def store_storefront_msg_mapping(shop_name: str, msg_id: str, action: StorefrontAction):
     if shop_exists(shop_name):
         storefront = get_storefront(shop_name)
         storefront[msg_mapping_index][msg_id] = action.to_string()
-        storefront.write()
+        _write_shop_file(storefront)
 
 
 def delete_storefront_msg_mapping(shop_name: str, msg_id: str):
@@ -886,7 +939,7 @@ def delete_storefront_msg_mapping(shop_name: str, msg_id: str):
         storefront = get_storefront(shop_name)
         if msg_id in storefront[msg_mapping_index]:
             del storefront[msg_mapping_index][msg_id]
-            storefront.write()
+            _write_shop_file(storefront)
 
 
 def read_storefront_msg_mapping(shop_name: str, msg_id: str):
@@ -901,7 +954,7 @@ def delete_storefront_msg_mappings_for_shop(shop_name: str):
         storefront = get_storefront(shop_name)
         for msg_id in storefront[msg_mapping_index]:
             del storefront[msg_mapping_index][msg_id]
-        storefront.write()
+        _write_shop_file(storefront)
 
 
 def get_delivery_choice_message(shop_name: str, guild_id: int):
@@ -920,7 +973,7 @@ def store_delivery_choice_message(shop_name: str, msg_id: str, guild_id: int):
         storefront[delivery_choice_msg_index][str(guild_id)] = msg_id
         action = StorefrontAction(StorefrontActionTypes.SetDeliveryOption)
         storefront[msg_mapping_index][msg_id] = action.to_string()
-        storefront.write()
+        _write_shop_file(storefront)
 
 
 def get_tipping_message(shop_name: str, guild_id: int):
@@ -941,7 +994,7 @@ def store_tipping_message(shop_name: str, msg_id: str, guild_id: int):
         storefront[tipping_msg_index][str(guild_id)] = msg_id
         action = StorefrontAction(StorefrontActionTypes.Tip)
         storefront[msg_mapping_index][msg_id] = action.to_string()
-        storefront.write()
+        _write_shop_file(storefront)
 
 
 def clear_storefront(shop_name: str):
@@ -952,7 +1005,7 @@ def clear_storefront(shop_name: str):
             del storefront[delivery_choice_msg_index]
         if tipping_msg_index in storefront:
             del storefront[tipping_msg_index]
-        storefront.write()
+        _write_shop_file(storefront)
 
 
 # The delivery ID of each player/actor is stored in a simple database
@@ -964,7 +1017,7 @@ delivery_ids_index = "___delivery_ids"
 def get_delivery_data(shop_name: str):
     shop_id = shop_name.lower()
     delivery_data_file_name = f"{shop_id}{delivery_data_suffix}"
-    return ConfigObj(str(config_dir / shops_conf_dir / delivery_data_file_name))
+    return _get_shop_file(delivery_data_file_name)
 
 
 def player_has_delivery_id(shop_name: str, player_id: str):
@@ -975,7 +1028,7 @@ def store_delivery_id(shop_name: str, player_id: str, delivery_id: str):
     if shop_exists(shop_name):
         delivery_data = get_delivery_data(shop_name)
         delivery_data[delivery_ids_index][player_id] = delivery_id
-        delivery_data.write()
+        _write_shop_file(delivery_data)
 
 
 def delete_delivery_id(shop_name: str, player_id: str):
@@ -983,7 +1036,7 @@ def delete_delivery_id(shop_name: str, player_id: str):
         delivery_data = get_delivery_data(shop_name)
         if player_id in delivery_data[delivery_ids_index]:
             del delivery_data[delivery_ids_index][player_id]
-            delivery_data.write()
+            _write_shop_file(delivery_data)
 
 
 def get_delivery_id(shop_name: str, player_id: str):
@@ -1001,7 +1054,7 @@ def clear_delivery_data(shop_name: str):
     if shop_exists(shop_name):
         delivery_data = get_delivery_data(shop_name)
         delivery_data[delivery_ids_index] = {}
-        delivery_data.write()
+        _write_shop_file(delivery_data)
 
 
 def delete_delivery_ids_for_actor(actor_id: str):
@@ -1010,158 +1063,153 @@ def delete_delivery_ids_for_actor(actor_id: str):
 
 
 async def clear_shop_contents(shop_name: str):
-    clear_catalogue(shop_name)
-    clear_delivery_data(shop_name)
-    clear_storefront(shop_name)
-    await clear_order_data(shop_name)
+    with shop_data_batch():
+        clear_catalogue(shop_name)
+        clear_delivery_data(shop_name)
+        clear_storefront(shop_name)
+        await clear_order_data(shop_name)
 
 
 # The active orders are stored indexed on delivery ID, since there can only be
-# one active order for each
+# one active order for each. Locked orders are stored indexed on order number.
 
-# Each active order also stores a counter-mapping: msg_id -> delivery ID
+# Each order also stores a counter-mapping: msg_id -> delivery ID / order number
 # These are linked -- mapping must be added when order is stored
 # Mapping must be removed when order is deleted (fetched)
 
+# All of it is kept in memory, keyed on (shop ID, ...), so that order flow reactions
+# never need to read anything. Every change is written through to the database,
+# which is only read at startup.
+active_orders: dict[tuple[str, str], Order] = {}
+locked_orders: dict[tuple[str, str], Order] = {}
+msg_to_order_mappings: dict[tuple[str, str], MsgOrderMapping] = {}
+
+# Where orders were stored before they moved to the database
 order_data_suffix = "_order_data.conf"
 active_orders_index = "___active_orders"
 locked_orders_index = "___locked_orders"
-msg_to_order_mapping_index = "___msg_to_order_mapping"
 
 
-def get_order_data(shop_name: str):
-    shop_id = shop_name.lower()
-    order_data_file_name = f"{shop_id}{order_data_suffix}"
-    return ConfigObj(str(config_dir / shops_conf_dir / order_data_file_name))
+def _get_orders(status: OrderStatus):
+    return active_orders if status == OrderStatus.Active else locked_orders
 
 
-def store_active_order(shop_name: str, order: Order):
-    if shop_exists(shop_name):
-        order_data = get_order_data(shop_name)
-        msg_id = str(order.order_flow_msg_id)
-        msg_mapping = MsgOrderMapping(order.delivery_id, OrderStatus.Active)
-        order_data[msg_to_order_mapping_index][msg_id] = msg_mapping.to_string()
-        order_data[active_orders_index][order.delivery_id] = order.to_string()
-        order_data.write()
+def _get_order_key(order: Order, status: OrderStatus):
+    return order.delivery_id if status == OrderStatus.Active else order.order_id
 
 
-def delete_active_order(shop_name: str, delivery_id: str):
-    if shop_exists(shop_name):
-        order_data = get_order_data(shop_name)
-        if delivery_id in order_data[active_orders_index]:
-            del order_data[active_orders_index][delivery_id]
-            order_data.write()
+def _index_order(shop_id: str, order: Order, status: OrderStatus):
+    key = _get_order_key(order, status)
+    _get_orders(status)[(shop_id, key)] = order
+    msg_id = str(order.order_flow_msg_id)
+    msg_to_order_mappings[(shop_id, msg_id)] = MsgOrderMapping(key, status)
 
 
-# Treat all output from this as read-only! If you need to edit the order, use fetch_order instead!
-def get_active_order(shop_name: str, delivery_id: str):
-    if shop_exists(shop_name):
-        order_data = get_order_data(shop_name)
-        return read_active_order_from_order_data(order_data, delivery_id)
+def _unindex_order(shop_id: str, key: str, status: OrderStatus):
+    order = _get_orders(status).pop((shop_id, key), None)
+    if order is not None:
+        msg_to_order_mappings.pop((shop_id, str(order.order_flow_msg_id)), None)
+    return order
+
+
+async def load_orders():
+    active_orders.clear()
+    locked_orders.clear()
+    msg_to_order_mappings.clear()
+    async with SessionM() as session:
+        for row in await order_db.load_all(session):
+            _index_order(
+                row.shop_id, Order.from_string(row.data), OrderStatus(row.status)
+            )
 
 
-def fetch_all_active_orders(shop_name: str):
+async def migrate_order_data_confs():
+    # Moves the orders out of the old per-shop order data files
+    for shop_id in get_all_shop_ids():
+        file_name = str(config_dir / shops_conf_dir / f"{shop_id}{order_data_suffix}")
+        if not os.path.exists(file_name):
+            continue
+        order_data = ConfigObj(file_name)
+        for order_string in order_data.get(active_orders_index, {}).values():
+            await store_active_order(shop_id, Order.from_string(order_string))
+        for order_string in order_data.get(locked_orders_index, {}).values():
+            await store_locked_order(shop_id, Order.from_string(order_string))
+        os.replace(file_name, f"{file_name}.migrated")
+
+
+async def _store_order(shop_name: str, order: Order, status: OrderStatus):
     if shop_exists(shop_name):
-        order_data = get_order_data(shop_name)
-        for delivery_id in order_data[active_orders_index]:
-            yield _fetch_active_order_from_order_data(order_data, delivery_id)
+        shop_id = shop_name.lower()
+        _index_order(shop_id, order, status)
+        async with SessionM() as session:
+            await order_db.save(
+                session,
+                shop_id,
+                status.value,
+                _get_order_key(order, status),
+                str(order.order_flow_msg_id),
+                order.to_string(),
+            )
 
 
-def fetch_active_order(shop_name: str, delivery_id: str):
+async def _delete_order(shop_name: str, key: str, status: OrderStatus):
     if shop_exists(shop_name):
-        order_data = get_order_data(shop_name)
-        return _fetch_active_order_from_order_data(order_data, delivery_id)
+        shop_id = shop_name.lower()
+        order = _unindex_order(shop_id, key, status)
+        if order is not None:
+            async with SessionM() as session:
+                await order_db.remove(session, shop_id, status.value, key)
+        return order
 
 
-def read_active_order_from_order_data(order_data, delivery_id: str):
-    if delivery_id in order_data[active_orders_index]:
-        return Order.from_string(order_data[active_orders_index][delivery_id])
+async def store_active_order(shop_name: str, order: Order):
+    await _store_order(shop_name, order, OrderStatus.Active)
 
 
-def _fetch_active_order_from_order_data(order_data, delivery_id: str):
-    if delivery_id in order_data[active_orders_index]:
-        order = Order.from_string(order_data[active_orders_index][delivery_id])
-        del order_data[active_orders_index][delivery_id]
-        msg_id = str(order.order_flow_msg_id)
-        if msg_id in order_data[msg_to_order_mapping_index]:
-            del order_data[msg_to_order_mapping_index][msg_id]
-        order_data.write()
-        return order
+async def delete_active_order(shop_name: str, delivery_id: str):
+    await _delete_order(shop_name, delivery_id, OrderStatus.Active)
 
 
-# The locked orders are stored indexed on order number
-def store_locked_order(shop_name: str, order: Order):
-    if shop_exists(shop_name):
-        order_data = get_order_data(shop_name)
-        msg_id = str(order.order_flow_msg_id)
-        msg_mapping = MsgOrderMapping(order.order_id, OrderStatus.Locked)
-        order_data[msg_to_order_mapping_index][msg_id] = msg_mapping.to_string()
-        order_data[locked_orders_index][order.order_id] = order.to_string()
-        order_data.write()
+# Treat all output from this as read-only! If you need to edit the order, use fetch_order instead!
+def get_active_order(shop_name: str, delivery_id: str):
+    return active_orders.get((shop_name.lower(), delivery_id))
 
 
-def delete_locked_order(shop_name: str, order_id: str):
-    if shop_exists(shop_name):
-        order_data = get_order_data(shop_name)
-        if order_id in order_data[locked_orders_index]:
-            del order_data[locked_orders_index][order_id]
-            order_data.write()
+async def fetch_active_order(shop_name: str, delivery_id: str):
+    return await _delete_order(shop_name, delivery_id, OrderStatus.Active)
 
 
-def get_locked_order(shop_name: str, order_id: str):
-    if shop_exists(shop_name):
-        order_data = get_order_data(shop_name)
-        return read_locked_order_from_order_data(order_data, order_id)
+async def store_locked_order(shop_name: str, order: Order):
+    await _store_order(shop_name, order, OrderStatus.Locked)
 
 
-def fetch_locked_order(shop_name: str, order_id: str):
-    if shop_exists(shop_name):
-        order_data = get_order_data(shop_name)
-        return fetch_locked_order_from_order_data(order_data, order_id)
+async def delete_locked_order(shop_name: str, order_id: str):
+    await _delete_order(shop_name, order_id, OrderStatus.Locked)
 
 
-def read_locked_order_from_order_data(order_data, order_id: str):
-    if order_id in order_data[locked_orders_index]:
-        return Order.from_string(order_data[locked_orders_index][order_id])
+# Read-only as well, just like get_active_order
+def get_locked_order(shop_name: str, order_id: str):
+    return locked_orders.get((shop_name.lower(), order_id))
 
 
-def fetch_locked_order_from_order_data(order_data, order_id: str):
-    if order_id in order_data[locked_orders_index]:
-        order = Order.from_string(order_data[locked_orders_index][order_id])
-        del order_data[locked_orders_index][order_id]
-        msg_id = str(order.order_flow_msg_id)
-        if msg_id in order_data[msg_to_order_mapping_index]:
-            del order_data[msg_to_order_mapping_index][msg_id]
-        order_data.write()
-        return order
+async def fetch_locked_order(shop_name: str, order_id: str):
+    return await _delete_order(shop_name, order_id, OrderStatus.Locked)
 
 
 def get_order_mapping_from_msg(shop_name: str, msg_id: str):
-    if shop_exists(shop_name):
-        order_data = get_order_data(shop_name)
-        if msg_id in order_data[msg_to_order_mapping_index]:
-            return MsgOrderMapping.from_string(
-                order_data[msg_to_order_mapping_index][msg_id]
-            )
+    return msg_to_order_mappings.get((shop_name.lower(), msg_id))
 
 
 async def clear_order_data(shop_name: str):
     if shop_exists(shop_name):
-        order_data = get_order_data(shop_name)
-        if active_orders_index not in order_data:
-            order_data[active_orders_index] = {}
-        if locked_orders_index not in order_data:
-            order_data[locked_orders_index] = {}
-        if msg_to_order_mapping_index not in order_data:
-            order_data[msg_to_order_mapping_index] = {}
-        order_data.write()
-
-        for order in fetch_all_active_orders(shop_name):
-            await order.remove_undo_hooks()
-        order_data[active_orders_index] = {}
-        order_data[locked_orders_index] = {}
-        order_data[msg_to_order_mapping_index] = {}
-        order_data.write()
+        shop_id = shop_name.lower()
+        for key in [key for key in active_orders if key[0] == shop_id]:
+            await active_orders.pop(key).remove_undo_hooks()
+        for orders in (locked_orders, msg_to_order_mappings):
+            for key in [key for key in orders if key[0] == shop_id]:
+                del orders[key]
+        async with SessionM() as session:
+            await order_db.clear(session, shop_id)
 
 
 ### Creating a new shop:
@@ -1595,22 +1643,79 @@ async def update_storefront(user_id: str, shop_name: str):
         return result.error_report
     shop: Shop = result.shop
 
+    start = time.perf_counter()
     tasks = (
         asyncio.create_task(_update_storefront_channel(shop, ch))
         for ch in shop.storefront_channels()
     )
-    await asyncio.gather(*tasks)
+    counts = sum(await asyncio.gather(*tasks), Counter())
+    elapsed = time.perf_counter() - start
+    return (
+        f"Updated the storefront of {shop.name} in {elapsed:.1f} s: "
+        f"{counts['unchanged']} products unchanged, {counts['edited']} edited, "
+        f"{counts['posted']} posted and {counts['removed']} removed."
+    )
+
+
+# Storefront messages are updated with at most this many requests in flight per
+# channel, to stay within Discord's per-channel rate limits instead of running into them
+storefront_channel_concurrency = 5
 
 
 async def _update_storefront_channel(shop: Shop, channel):
-    await update_storefront_delivery_choice_message(shop, channel)
+    # Diffs the catalogue against the messages already in the channel: unchanged
+    # products are left alone, changed ones are edited concurrently, and products
+    # without a message are posted at the end, in catalogue order.
+    start = time.perf_counter()
+    counts = Counter()
+    limiter = asyncio.Semaphore(storefront_channel_concurrency)
+    with shop_data_batch():
+        await update_storefront_delivery_choice_message(shop, channel)
+
+        existing = {
+            message.id: message async for message in channel.history(limit=None)
+        }
+        products = list(get_all_products(shop.shop_id))
+        results = await asyncio.gather(
+            *(
+                _update_existing_catalogue_item_message(
+                    shop, channel, product, existing, limiter
+                )
+                for product in products
+            )
+        )
+        reaction_tasks = []
+        for product, result in zip(products, results, strict=True):
+            if result is None:
+                message = await _post_catalogue_item_message(shop, channel, product)
+                if product.in_stock:
+                    reaction_tasks.append(
+                        asyncio.create_task(
+                            _limited(limiter, message.add_reaction(product.emoji))
+                        )
+                    )
+                result = "posted"
+            counts[result] += 1
+        await asyncio.gather(*reaction_tasks)
 
-    for product in get_all_products(shop.shop_id):
-        await update_catalogue_item_message(shop, channel, product)
+        if counts["posted"] > 0 or not _tipping_message_is_current(
+            shop, channel, existing
+        ):
+            await update_storefront_tipping_message(shop, channel)
 
-    await update_storefront_tipping_message(shop, channel)
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Updated storefront {channel.name} in {channel.guild.name} in {elapsed:.1f} s "
+        f"({dict(counts)})"
+    )
+    return counts
 
-    return "Done."
+
+async def _limited(limiter: asyncio.Semaphore | None, coro):
+    if limiter is None:
+        return await coro
+    async with limiter:
+        return await coro
 
 
 # Delivery choice message: a welcome message that allows customers to choose where to get their order delivered
@@ -1696,51 +1801,89 @@ async def post_catalogue_item(user_id: str, product_name: str, shop_name: str):
 
 
 async def update_catalogue_item_message(shop: Shop, channel, product: Product):
+    if await _update_existing_catalogue_item_message(shop, channel, product) is None:
+        message = await _post_catalogue_item_message(shop, channel, product)
+        if product.in_stock:
+            await message.add_reaction(product.emoji)
+
+
+async def _get_storefront_message(channel, msg_id: str, existing: dict | None):
+    if existing is not None:
+        return existing.get(int(msg_id))
+    try:
+        return await channel.fetch_message(msg_id)
+    except discord.errors.NotFound:
+        # Reference to a message in storefront that is no longer available
+        # Either due to reinitialize(), or due to being removed by an admin
+        return None
+
+
+def _has_product_reactions(message, product: Product):
+    return own_reactions(message) == ([product.emoji] if product.in_stock else [])
+
+
+async def _update_existing_catalogue_item_message(
+    shop: Shop,
+    channel,
+    product: Product,
+    existing: dict | None = None,
+    limiter: asyncio.Semaphore | None = None,
+):
+    # Brings the product's message in this channel up to date and returns what was
+    # done with it, or returns None if the product needs a new message.
+    msg_id = product.get_storefront_message_id(channel.guild.id)
+    message = (
+        None
+        if msg_id is None
+        else await _get_storefront_message(channel, msg_id, existing)
+    )
     if not product.available:
-        msg_id = product.get_storefront_message_id(channel.guild.id)
-        if msg_id is not None:
-            delete_storefront_msg_mapping(shop.shop_id, msg_id)
-            try:
-                message = await channel.fetch_message(msg_id)
-                await message.delete()
-            except discord.errors.NotFound:
-                # Reference to a message in storefront that is no longer available
-                # Doesn't matter since the product should not be available anyway
-                pass
-        return
+        if msg_id is None:
+            return "unchanged"
+        delete_storefront_msg_mapping(shop.shop_id, msg_id)
+        if message is not None:
+            with contextlib.suppress(discord.errors.NotFound):
+                await _limited(limiter, message.delete())
+        return "removed"
 
     # If we get here, the product is set to available, so we need to
     # either post the message or edit the existing one to updated description
-    content = generate_catalogue_item_message(product)
-    previous_msg = product.get_storefront_message_id(channel.guild.id)
-    if previous_msg is not None:
-        # Instead of sending a new message, update the existing one
-        delete_storefront_msg_mapping(shop.shop_id, previous_msg)
-        try:
-            message = await channel.fetch_message(previous_msg)
-            await asyncio.gather(
-                *[
-                    asyncio.create_task(c)
-                    for c in [message.clear_reactions(), message.edit(content=content)]
-                ]
-            )
-        except discord.errors.NotFound:
-            # Reference to a message in storefront that is no longer available
-            # Either due to reinitialize(), or due to being removed by an admin
-            previous_msg = None
-    if previous_msg is None:
-        # There is no previous message to update so we must send a new one
-        message = await channel.send(content)
+    if message is None:
+        if msg_id is not None:
+            delete_storefront_msg_mapping(shop.shop_id, msg_id)
+        return None
 
-    if message is not None:
-        product.set_storefront_message_id(channel.guild.id, str(message.id))
-        if product.in_stock:
-            await message.add_reaction(product.emoji)
+    content = generate_catalogue_item_message(product)
+    edits = []
+    if message.content != content:
+        edits.append(_limited(limiter, message.edit(content=content)))
+    if not _has_product_reactions(message, product):
+        edits.append(_reset_product_reactions(message, product, limiter))
+    await asyncio.gather(*edits)
+    if read_storefront_msg_mapping(shop.shop_id, msg_id) is None:
         action = StorefrontAction(StorefrontActionTypes.Order, data=product.product_id)
-        store_storefront_msg_mapping(shop.shop_id, str(message.id), action)
-        store_product(shop.shop_id, product)
-    else:
+        store_storefront_msg_mapping(shop.shop_id, msg_id, action)
+    return "edited" if edits else "unchanged"
+
+
+async def _reset_product_reactions(
+    message, product: Product, limiter: asyncio.Semaphore | None
+):
+    await _limited(limiter, message.clear_reactions())
+    if product.in_stock:
+        await _limited(limiter, message.add_reaction(product.emoji))
+
+
+async def _post_catalogue_item_message(shop: Shop, channel, product: Product):
+    # There is no previous message to update so we must send a new one
+    message = await channel.send(generate_catalogue_item_message(product))
+    if message is None:
         raise RuntimeError(f"Failed to publish product, dump: {product.to_string()}")
+    product.set_storefront_message_id(channel.guild.id, str(message.id))
+    action = StorefrontAction(StorefrontActionTypes.Order, data=product.product_id)
+    store_storefront_msg_mapping(shop.shop_id, str(message.id), action)
+    store_product(shop.shop_id, product)
+    return message
 
 
 def generate_catalogue_item_message(product):
@@ -1755,6 +1898,27 @@ def generate_catalogue_item_message(product):
 # The tipping message: reactions here will transfer some money to the staff
 
 
+def _tipping_message_is_current(shop: Shop, channel, existing: dict):
+    # The tipping message needs no repost if it is still the last message
+    # in the channel and nothing has changed about it
+    msg_id = get_tipping_message(shop.shop_id, channel.guild.id)
+    if msg_id is None or int(msg_id) not in existing or int(msg_id) != max(existing):
+        return False
+    message = existing[int(msg_id)]
+    tipping_tuples = shop.generate_tips_list()
+    return message.content == generate_tipping_message(tipping_tuples) and (
+        own_reactions(message) == [emoji for (_, emoji) in tipping_tuples]
+    )
+
+
+def generate_tipping_message(tipping_tuples: list[tuple[str, str]]):
+    content = "Don't forget to tip the servers and staff! Working right now:\n"
+    for handle_id, emoji in tipping_tuples:
+        content += f"{emoji}: **{handle_id}**\n"
+    content += f"One reaction = **{coin} 1**!"
+    return content
+
+
 async def update_storefront_tipping_message(shop: Shop, channel):
     prev_msg_id = get_tipping_message(shop.shop_id, channel.guild.id)
     # The tipping message is at the bottom of the channel, so it needs to be re-posted every time to ensure the correct order
@@ -1771,16 +1935,13 @@ async def update_storefront_tipping_message(shop: Shop, channel):
 
     tipping_tuples = shop.generate_tips_list()
     if len(tipping_tuples) > 0:
-        content = "Don't forget to tip the servers and staff! Working right now:\n"
-        for handle_id, emoji in tipping_tuples:
-            content += f"{emoji}: **{handle_id}**\n"
-        content += f"One reaction = **{coin} 1**!"
-        message = await channel.send(content)
+        message = await channel.send(generate_tipping_message(tipping_tuples))
         if message is not None:
             store_tipping_message(shop.shop_id, str(message.id), channel.guild.id)
-            for _, emoji in tipping_tuples:
-                logger.debug(f"Adding reaction: {emoji}")
-                await message.add_reaction(emoji)
+            # One at a time, so the buttons come in the same order as the lines
+            await seed_reactions(
+                message, [emoji for (_, emoji) in tipping_tuples], concurrency=1
+            )
         else:
             raise RuntimeError(
                 f"Failed to post tipping message for shop, dump: {shop.to_string()}"
@@ -1883,9 +2044,9 @@ async def process_reaction_in_order_flow(channel_id: str, msg_id: str, emoji: st
         )
         order = None
         if mapping.status == OrderStatus.Active:
-            order = fetch_active_order(shop.shop_id, mapping.identifier)
+            order = await fetch_active_order(shop.shop_id, mapping.identifier)
         elif mapping.status == OrderStatus.Locked:
-            order = fetch_locked_order(shop.shop_id, mapping.identifier)
+            order = await fetch_locked_order(shop.shop_id, mapping.identifier)
         if order is None:
             result.report = f"Error: tried to fetch order for {mapping.identifier} but could not find it. DB corrupt."
             return result
@@ -2038,7 +2199,7 @@ async def place_order_in_flow(
     shop: Shop, purchase: Transaction, delivery_id: str, pre_paid: bool
 ):
     previous_order_updated = False
-    order = fetch_active_order(shop.shop_id, delivery_id)
+    order = await fetch_active_order(shop.shop_id, delivery_id)
     if order is not None:
         # The previous order will have been deleted from active_orders
         time_diff = PostTimestamp.get_time_diff(order.time_created, purchase.timestamp)
@@ -2066,7 +2227,7 @@ async def place_order_in_flow(
         message = await order_flow_channel.send(post)
         await add_gui_reactions_to_order(message, OrderStatus.Active)
         order.order_flow_msg_id = message.id
-    store_active_order(shop.shop_id, order)
+    await store_active_order(shop.shop_id, order)
 
 
 async def add_to_active_order(
@@ -2108,7 +2269,7 @@ async def lock_active_order(shop: Shop, order: Order):
         await add_gui_reactions_to_order(message, OrderStatus.Locked)
         order.order_flow_msg_id = message.id
 
-    store_locked_order(shop.shop_id, order)
+    await store_locked_order(shop.shop_id, order)
 
 
 async def deliver_order(shop: Shop, order: Order, status: OrderStatus):
@@ -2183,7 +2344,7 @@ async def attempt_refund(transaction: Transaction, initiator_id: str):
             return
 
     async with get_order_semaphore(shop.shop_id, delivery_id):
-        order = fetch_active_order(shop_id, delivery_id)
+        order = await fetch_active_order(shop_id, delivery_id)
         if order is None:
             if initiated_by_shop:
                 transaction.report = (
@@ -2267,7 +2428,7 @@ async def execute_refund_in_order_flow(shop: Shop, refund: Transaction, order: O
             content = generate_order_message(order, OrderStatus.Active)
             message = await order_flow_channel.send(content)
             order.order_flow_msg_id = message.id
-            store_active_order(shop.shop_id, order)
+            await store_active_order(shop.shop_id, order)
 
     if order_empty:
         # There is nothing left, so we shall remove the order
@@ -2281,7 +2442,7 @@ async def execute_refund_in_order_flow(shop: Shop, refund: Transaction, order: O
         order.price_total -= refund.amount
         content = generate_order_message(order, OrderStatus.Active)
         await order_flow_message.edit(content=content)
-        store_active_order(shop.shop_id, order)
+        await store_active_order(shop.shop_id, order)
 
 
 ### Tipping staff
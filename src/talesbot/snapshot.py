@@ -0,0 +1,116 @@
+import hashlib
+import logging
+import os
+import struct
+import time
+import zlib
+from collections import Counter
+from collections.abc import Iterable
+
+import simplejson
+from configobj import ConfigObj
+
+from .config import config_dir
+
+### Module snapshot.py
+# A snapshot of the config files that are kept in memory (handles and shops), so
+# that a restart reads one file instead of parsing every one of them.
+# For every file the snapshot holds its parsed contents, along with the size and
+# modification time the file had when the snapshot was taken. A file that has been
+# written since then is stale and is parsed from disk, just like a file that is not
+# in the snapshot at all.
+# The snapshot starts with a version tag and a checksum of the rest. A snapshot
+# with another version or a checksum that does not match is ignored.
+
+snapshot_file_name = str(config_dir / "snapshot.bin")
+snapshot_magic = b"TALESNAP"
+# Bump when the contents of the snapshot change
+snapshot_version = 1
+# Seconds between the snapshots written while the bot is running
+snapshot_interval = 300
+snapshot_header = struct.Struct(">8sH32s")
+
+# file name -> (modification time in ns, size, contents), read from the snapshot.
+# Kept until the next snapshot is written, since stores that are loaded more than
+# once during startup (e.g. lazily, then again by init) use it every time.
+snapshot_entries: dict[str, tuple[int, int, dict]] = {}
+# file name -> ConfigObj, all files that go into the next snapshot
+tracked_confs: dict[str, ConfigObj] = {}
+# How the files were loaded: "snapshot", "stale" or "parsed"
+conf_loads: Counter[str] = Counter()
+
+logger = logging.getLogger(__name__)
+
+
+def _file_stamp(file_name: str):
+    try:
+        stat = os.stat(file_name)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load():
+    # Returns True if a usable snapshot was found
+    snapshot_entries.clear()
+    conf_loads.clear()
+    if not os.path.exists(snapshot_file_name):
+        return False
+    with open(snapshot_file_name, "rb") as f:
+        data = f.read()
+    if len(data) < snapshot_header.size:
+        logger.warning("Ignoring snapshot: the file is truncated")
+        return False
+    (magic, version, checksum) = snapshot_header.unpack_from(data)
+    payload = data[snapshot_header.size :]
+    if magic != snapshot_magic or version != snapshot_version:
+        logger.info(f"Ignoring snapshot with version {version}")
+        return False
+    if hashlib.sha256(payload).digest() != checksum:
+        logger.warning("Ignoring snapshot: the checksum does not match")
+        return False
+    files = simplejson.loads(zlib.decompress(payload))
+    for file_name, (mtime_ns, size, contents) in files.items():
+        snapshot_entries[file_name] = (mtime_ns, size, contents)
+    logger.info(f"Loaded snapshot of {len(snapshot_entries)} files")
+    return True
+
+
+def load_conf(file_name: str) -> ConfigObj:
+    # Use instead of ConfigObj(file_name) for files that are kept in memory
+    entry = snapshot_entries.get(file_name)
+    if entry is not None and _file_stamp(file_name) == (entry[0], entry[1]):
+        conf = ConfigObj(entry[2])
+        conf.filename = file_name
+        conf_loads["snapshot"] += 1
+    else:
+        conf = ConfigObj(file_name)
+        conf_loads["parsed" if entry is None else "stale"] += 1
+    tracked_confs[file_name] = conf
+    return conf
+
+
+def write(skip: Iterable[str] = ()):
+    # Files with changes that have not been written yet must be skipped,
+    # or their contents would not match the file they were taken from
+    start = time.perf_counter()
+    skipped = set(skip)
+    files = {}
+    for file_name, conf in tracked_confs.items():
+        stamp = _file_stamp(file_name)
+        if stamp is not None and file_name not in skipped:
+            files[file_name] = (*stamp, conf.dict())
+    payload = zlib.compress(simplejson.dumps(files).encode("utf-8"))
+    header = snapshot_header.pack(
+        snapshot_magic, snapshot_version, hashlib.sha256(payload).digest()
+    )
+    tmp_file_name = f"{snapshot_file_name}.tmp"
+    with open(tmp_file_name, "wb") as f:
+        f.write(header + payload)
+    os.replace(tmp_file_name, snapshot_file_name)
+    # Superseded by the files that are tracked now
+    snapshot_entries.clear()
+    logger.debug(
+        f"Wrote snapshot of {len(files)} files ({len(payload)} bytes) "
+        f"in {time.perf_counter() - start:.2f} s"
+    )
@@ -0,0 +1,103 @@
+import asyncio
+import inspect
+import logging
+import time
+from collections.abc import Awaitable, Callable, Iterable
+
+### Module startup.py
+# Runs the initialisation of the bot's subsystems as a set of named phases.
+# Every phase says which other phases it needs; a phase starts as soon as those
+# have finished, so phases that do not depend on each other run concurrently.
+# Each phase runs exactly once per startup, however many phases depend on it.
+# Dependencies on phases that were never added (e.g. because they are switched
+# off in the config) are ignored.
+
+logger = logging.getLogger(__name__)
+
+PhaseFunction = Callable[[], Awaitable[object] | object]
+
+
+class _Phase:
+    __slots__ = ("name", "func", "after", "task", "started", "elapsed")
+
+    def __init__(self, name: str, func: PhaseFunction, after: list[str]):
+        self.name = name
+        self.func = func
+        self.after = after
+        self.task: asyncio.Task | None = None
+        self.started = 0.0
+        self.elapsed = 0.0
+
+
+class Startup:
+    def __init__(self):
+        self.phases: dict[str, _Phase] = {}
+        self.start = 0.0
+
+    def add(self, name: str, func: PhaseFunction, after: Iterable[str] = ()):
+        if name in self.phases:
+            raise ValueError(f"Startup phase {name} has already been added")
+        self.phases[name] = _Phase(name, func, list(after))
+
+    def _dependencies(self, phase: _Phase):
+        return [self.phases[name] for name in phase.after if name in self.phases]
+
+    def _check_for_cycles(self):
+        done: set[str] = set()
+
+        def visit(phase: _Phase, path: list[str]):
+            if phase.name in path:
+                cycle = " -> ".join(path[path.index(phase.name) :] + [phase.name])
+                raise ValueError(f"Startup phases depend on each other: {cycle}")
+            if phase.name in done:
+                return
+            for dependency in self._dependencies(phase):
+                visit(dependency, path + [phase.name])
+            done.add(phase.name)
+
+        for phase in self.phases.values():
+            visit(phase, [])
+
+    def _run_phase(self, phase: _Phase) -> asyncio.Task:
+        if phase.task is None:
+            phase.task = asyncio.create_task(self._phase(phase), name=phase.name)
+        return phase.task
+
+    async def _phase(self, phase: _Phase):
+        await asyncio.gather(
+            *(self._run_phase(dependency) for dependency in self._dependencies(phase))
+        )
+        phase.started = time.perf_counter()
+        try:
+            result = phase.func()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            # The phases that depend on this one fail with the same error
+            logger.exception(f"Startup phase {phase.name} failed")
+            raise
+        phase.elapsed = time.perf_counter() - phase.started
+        logger.info(
+            f"Startup phase {phase.name} took {phase.elapsed:.2f} s "
+            f"(started at {phase.started - self.start:.2f} s)"
+        )
+
+    async def run(self):
+        # Returns the time each phase took; raises the first error once every
+        # phase that could run has finished
+        self._check_for_cycles()
+        self.start = time.perf_counter()
+        results = await asyncio.gather(
+            *(self._run_phase(phase) for phase in self.phases.values()),
+            return_exceptions=True,
+        )
+        elapsed = time.perf_counter() - self.start
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            logger.error(f"Startup failed after {elapsed:.2f} s")
+            raise errors[0]
+        logger.info(
+            f"Startup took {elapsed:.2f} s, the phases together "
+            f"{sum(phase.elapsed for phase in self.phases.values()):.2f} s"
+        )
+        return {phase.name: phase.elapsed for phase in self.phases.values()}
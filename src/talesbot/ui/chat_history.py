@@ -0,0 +1,107 @@
+import asyncio
+import contextlib
+from collections.abc import Callable
+
+import discord
+from discord import Interaction, ui
+
+# Loads the history that comes before the given log index.
+# Returns the index where the loaded part starts, and the loaded part as pages.
+HistoryLoader = Callable[[int], tuple[int, list[str]]]
+
+# The views whose buttons still work. Views do not survive a restart, so their
+# buttons are disabled when the bot shuts down, just like when they time out.
+open_history_views: set["ChatHistoryView"] = set()
+
+
+class EarlierButton(ui.Button["ChatHistoryView"]):
+    def __init__(self):
+        super().__init__(label="Show earlier", style=discord.ButtonStyle.blurple)
+
+    async def callback(self, interaction: Interaction):
+        assert self.view is not None
+        view = self.view
+        if view.page + 1 >= len(view.pages):
+            view.load_earlier()
+        view.page = min(view.page + 1, len(view.pages) - 1)
+        view.update_button_state()
+        await view.show_page(interaction)
+
+
+class LaterButton(ui.Button["ChatHistoryView"]):
+    def __init__(self):
+        super().__init__(label="Later", disabled=True)
+
+    async def callback(self, interaction: Interaction):
+        assert self.view is not None
+        view = self.view
+        view.page = max(view.page - 1, 0)
+        view.update_button_state()
+        await view.show_page(interaction)
+
+
+class ChatHistoryView(ui.View):
+    # Pages backwards through the history of a chat, one message-sized page at a time.
+    # Pages are only loaded from the log when someone asks for them.
+    def __init__(self, loader: HistoryLoader, start: int) -> None:
+        super().__init__(timeout=900)
+        self.loader = loader
+        # The message the view is attached to, set by whoever sends it
+        self.message: discord.Message | None = None
+        # Everything before this log index has not been loaded yet
+        self.start = start
+        # Newest first; page -1 is the initial "earlier history" message
+        self.pages: list[str] = []
+        self.page = -1
+
+        self.earlier = EarlierButton()
+        self.later = LaterButton()
+        self.add_item(self.earlier)
+        self.add_item(self.later)
+        open_history_views.add(self)
+
+    async def on_timeout(self):
+        await self.disable()
+
+    async def disable(self):
+        open_history_views.discard(self)
+        self.stop()
+        for button in [self.earlier, self.later]:
+            button.disabled = True
+            button.style = discord.ButtonStyle.gray
+        if self.message is not None:
+            with contextlib.suppress(discord.HTTPException):
+                await self.message.edit(view=self)
+
+    def load_earlier(self):
+        if self.start > 0:
+            (self.start, pages) = self.loader(self.start)
+            self.pages.extend(reversed(pages))
+
+    def update_button_state(self):
+        at_first_page = self.page >= len(self.pages) - 1 and self.start == 0
+        self.earlier.disabled = at_first_page
+        self.earlier.style = (
+            discord.ButtonStyle.gray if at_first_page else discord.ButtonStyle.blurple
+        )
+        self.later.disabled = self.page <= 0
+        self.later.style = (
+            discord.ButtonStyle.gray if self.page <= 0 else discord.ButtonStyle.blurple
+        )
+
+    async def show_page(self, interaction: Interaction):
+        if 0 <= self.page < len(self.pages):
+            await interaction.response.edit_message(
+                content=self.pages[self.page], view=self
+            )
+        else:
+            open_history_views.discard(self)
+            self.stop()
+            await interaction.response.edit_message(
+                content="```[no earlier history]```", view=None
+            )
+
+
+async def disable_open_history_views():
+    views = list(open_history_views)
+    await asyncio.gather(*(view.disable() for view in views))